@@ -6,11 +6,244 @@ Safe autonomous navigation using vision-based optical flow balancing.
 Includes command smoothing, safety checks, and manual confirmation mode.
 """
 
+import sys
 import time
+import queue
+import threading
+import asyncio
 import numpy as np
-from collections import deque
+from collections import namedtuple
+from dataclasses import dataclass, replace
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from vision.utils.jit import njit
+
+try:
+    import aiohttp  # Optional: only needed for AsyncAutopilotController
+except ImportError:
+    aiohttp = None
+
+# Action codes returned by _compute_core (index into ACTION_NAMES)
+ACTION_STOP = 0
+ACTION_FORWARD_SLOW = 1
+ACTION_CRUISE = 2
+ACTION_SLOWING = 3
+ACTION_TOO_FAST = 4
+ACTION_OBSTACLE_CAUTION = 5
+ACTION_OBSTACLE_AVOID = 6
+ACTION_OBSTACLE_CLIMB = 7
+ACTION_OBSTACLE_DESCEND = 8
+ACTION_EMERGENCY = 9
+ACTION_STOPPED = 10
+
+ACTION_NAMES = (
+    'STOP', 'FORWARD_SLOW', 'CRUISE', 'SLOWING', 'TOO_FAST',
+    'OBSTACLE_CAUTION', 'OBSTACLE_AVOID', 'OBSTACLE_CLIMB', 'OBSTACLE_DESCEND',
+    'EMERGENCY', 'STOPPED'
+)
+
+# Column order of the safe-direction array used by compute_control_batch()
+SAFE_DIRECTIONS = ('forward', 'left', 'right', 'up', 'down')
+
+
+class VisionResult(namedtuple('VisionResult', [
+        'lateral_balance', 'flow_magnitude', 'danger_level',
+        'fwd_safe', 'left_safe', 'right_safe', 'up_safe', 'down_safe'])):
+    """Flat view of the obstacle detector metrics used by the autopilot."""
+    
+    __slots__ = ()
+    
+    @classmethod
+    def from_dict(cls, vision_result):
+        """
+        Build from an obstacle detector result dict.
+        
+        Returns:
+            VisionResult, or None if the result has no flow balance yet
+        """
+        balance = vision_result.get('balance')
+        if balance is None:
+            return None
+        
+        safe_dirs = vision_result['safe_directions']
+        return cls(
+            balance['lateral_balance'],
+            vision_result['flow_magnitude'],
+            vision_result['danger_level'],
+            *(safe_dirs.get(direction, True) for direction in SAFE_DIRECTIONS)
+        )
+
+
+@dataclass(slots=True)
+class ControlCommand:
+    """Autopilot command produced by compute_control()."""
+    
+    vx: float = 0.0        # Forward (m/s)
+    vy: float = 0.0        # Lateral (m/s), positive = left
+    vz: float = 0.0        # Vertical (m/s), positive = up
+    yaw: float = 0.0       # Yaw rate (deg/s)
+    action: str = 'STOPPED'
+    balance: float = 0.0   # Lateral flow balance it was computed from
+    flow: float = 0.0      # Flow magnitude (px/frame)
+    danger: int = 0        # Danger level
+
+
+@njit(cache=True, fastmath=True)
+def _compute_core(lateral_balance, flow_mag, danger_level,
+                  left_safe, right_safe, up_safe, down_safe,
+                  balance_gain, speed_gain, target_flow, deadband,
+                  min_vx, max_vx, max_vy, max_vz, max_yaw):
+    """
+    Numeric core of AutopilotController.compute_control().
+    
+    Called once the forward path is known to be clear (the emergency stop
+    checks stay in Python). Compiled with Numba when available.
+    
+    Returns:
+        (vx, vy, vz, yaw, action_code)
+    """
+    # Initialize commands
+    vx = 0.0  # forward/back
+    vy = 0.0  # left/right
+    vz = 0.0  # up/down
+    yaw = 0.0  # rotation
+    action = ACTION_CRUISE
+    
+    # Lateral balance control (bee navigation)
+    # Negative balance = right side has more flow -> move LEFT (positive vy)
+    # Positive balance = left side has more flow -> move RIGHT (negative vy)
+    vy = -lateral_balance * balance_gain
+    
+    # Apply deadband
+    if abs(vy) < deadband:
+        vy = 0.0
+    
+    # Forward speed control based on flow magnitude
+    # If flow is low, we can move forward
+    # If flow is high, slow down or stop
+    flow_error = (flow_mag - target_flow) / (target_flow + 0.01)
+    
+    if flow_mag < target_flow * 0.5:
+        # Very low flow, safe to move forward at slow speed
+        vx = 0.2
+        action = ACTION_FORWARD_SLOW
+    elif flow_mag < target_flow * 1.2:
+        # Good flow, maintain slow forward speed
+        vx = 0.15 - (flow_error * speed_gain)
+        action = ACTION_CRUISE
+    elif flow_mag < target_flow * 1.5:
+        # Flow getting high, slow down
+        vx = max(0.0, 0.1 - flow_error * speed_gain)
+        action = ACTION_SLOWING
+    else:
+        # Flow too high, stop
+        vx = 0.0
+        action = ACTION_TOO_FAST
+    
+    # Obstacle avoidance adjustments
+    if danger_level >= 1:
+        # Reduce speed when obstacles detected
+        vx *= 0.5
+        action = ACTION_OBSTACLE_CAUTION
+        
+    if danger_level >= 2:
+        # Stop forward motion, focus on avoiding
+        vx = 0.0
+        action = ACTION_OBSTACLE_AVOID
+        
+        # Increase lateral correction
+        vy *= 1.5
+        
+        # If still blocked after correction, try vertical
+        if not left_safe and not right_safe:
+            if up_safe:
+                vz = 0.15
+                action = ACTION_OBSTACLE_CLIMB
+            elif down_safe:
+                vz = -0.10
+                action = ACTION_OBSTACLE_DESCEND
+    
+    # Clamp to safety limits
+    vx = max(min_vx, min(max_vx, vx))
+    vy = max(-max_vy, min(max_vy, vy))
+    vz = max(-max_vz, min(max_vz, vz))
+    yaw = max(-max_yaw, min(max_yaw, yaw))
+    
+    return vx, vy, vz, yaw, action
+
+
+@njit(cache=True)
+def _smooth_core(buf, total, idx, count, vx, vy, vz, yaw):
+    """
+    Push one command into the smoothing ring buffer and return the average.
+    
+    Updates buf (N, 4) and the running sum total (4,) in place. Compiled
+    with Numba when available, so a smoothing step is a single call.
+    
+    Returns:
+        (vx, vy, vz, yaw, idx, count) - smoothed commands and new cursor/count
+    """
+    n = buf.shape[0]
+    new = (vx, vy, vz, yaw)
+    
+    for j in range(4):
+        # Evict oldest entry from running sum once the window is full
+        if count == n:
+            total[j] -= buf[idx, j]
+        buf[idx, j] = new[j]
+        total[j] += new[j]
+    
+    idx = (idx + 1) % n
+    count = min(count + 1, n)
+    
+    # Moving average from running sum (O(1) per call)
+    return (total[0] / count, total[1] / count,
+            total[2] / count, total[3] / count, idx, count)
+
+
+@njit(cache=True)
+def _compute_core_batch(balance, flow, danger, safe,
+                        balance_gain, speed_gain, target_flow, deadband,
+                        min_vx, max_vx, max_vy, max_vz, max_yaw):
+    """
+    Run the compute_control() state machine over a sequence of vision results.
+    
+    Applies the same consecutive-stop rule as the controller: the third stop
+    in a row becomes EMERGENCY and every later row is STOPPED.
+    
+    Returns:
+        commands: (N, 4) array of [vx, vy, vz, yaw]
+        actions: (N,) array of action codes
+    """
+    n = balance.shape[0]
+    commands = np.zeros((n, 4))
+    actions = np.empty(n, dtype=np.int64)
+    consecutive_stops = 0
+    
+    for i in range(n):
+        if consecutive_stops >= 3:
+            actions[i] = ACTION_STOPPED
+            continue
+        
+        if danger[i] >= 3 or not safe[i, 0]:
+            consecutive_stops += 1
+            actions[i] = ACTION_EMERGENCY if consecutive_stops >= 3 else ACTION_STOP
+            continue
+        
+        consecutive_stops = 0
+        vx, vy, vz, yaw, action = _compute_core(
+            balance[i], flow[i], danger[i],
+            safe[i, 1], safe[i, 2], safe[i, 3], safe[i, 4],
+            balance_gain, speed_gain, target_flow, deadband,
+            min_vx, max_vx, max_vy, max_vz, max_yaw
+        )
+        commands[i, 0] = vx
+        commands[i, 1] = vy
+        commands[i, 2] = vz
+        commands[i, 3] = yaw
+        actions[i] = action
+    
+    return commands, actions
 
 
 class AutopilotController:
@@ -31,6 +264,21 @@ class AutopilotController:
     - Only one command active at a time
     """
     
+    # Confirmation banner, formatted in one pass per command
+    _CONFIRM_TEMPLATE = (
+        "\n" + "=" * 50 + "\n"
+        "📋 AUTOPILOT COMMAND: {action}\n"
+        "   Forward: {vx:+.2f} m/s\n"
+        "   Lateral: {vy:+.2f} m/s  {arrow}\n"
+        "   Vertical: {vz:+.2f} m/s\n"
+        "   Yaw: {yaw:+.1f} °/s\n"
+        "   Balance: {balance:+.2f}\n"
+        "   Flow: {flow:.2f} px/frame\n"
+        "   Danger: {danger}/5\n"
+        + "=" * 50 + "\n"
+    )
+    _LATERAL_ARROWS = ('→ RIGHT', '⊙ CENTER', '← LEFT')  # Indexed by sign(vy) + 1
+    
     def __init__(self, api_url="http://localhost:9000", 
                  confirmation_mode=True,
                  command_history_size=5):
@@ -43,16 +291,34 @@ class AutopilotController:
             command_history_size: Number of commands to average for smoothing
         """
         self.api_url = api_url
+        
+        # Pre-built endpoint URLs (the API only has a handful of commands)
+        self._endpoints = {
+            command: f"{api_url}/api/{command}"
+            for command in ('move/up', 'move/down', 'move/left', 'move/right',
+                            'yaw/left', 'yaw/right', 'stop', 'drone/stop')
+        }
         self.confirmation_mode = confirmation_mode
         self.enabled = False
         self.emergency_stop = False
         
-        # Command smoothing
+        # Direction bit mask -> burst of endpoint URLs (see _send_velocity_command)
+        self._command_table = self._build_command_table()
+        
+        # Persistent HTTP session (pooled adapter, prebuilt request state).
+        # The API server closes the socket after every response, so ask for
+        # Connection: close: a reused socket would already be dead and the
+        # command sent on it lost
+        self._session = requests.Session()
+        self._session.headers['Connection'] = 'close'
+        self._session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=0))
+        
+        # Command smoothing (ring buffer of [vx, vy, vz, yaw] + running sum)
         self.command_history_size = command_history_size
-        self.vx_history = deque(maxlen=command_history_size)
-        self.vy_history = deque(maxlen=command_history_size)
-        self.vz_history = deque(maxlen=command_history_size)
-        self.yaw_history = deque(maxlen=command_history_size)
+        self._cmd_buf = np.zeros((command_history_size, 4), dtype=np.float64)
+        self._cmd_sum = np.zeros(4)
+        self._cmd_idx = 0
+        self._cmd_count = 0
         
         # Safety parameters
         self.max_vx = 0.5  # m/s forward (conservative)
@@ -62,6 +328,7 @@ class AutopilotController:
         
         self.min_vx = -0.2  # m/s backward (very limited)
         self.deadband = 0.05  # Ignore commands smaller than this
+        self.yaw_deadband = 5.0  # deg/s - ignore yaw rates smaller than this
         
         # Control gains (conservative for safety)
         self.balance_gain = 0.3  # Lateral correction gain
@@ -72,15 +339,69 @@ class AutopilotController:
         self.target_flow = 3.0  # pixels/frame (slow and safe)
         
         # State tracking
-        self.last_command_time = 0
-        self.command_rate_limit = 0.2  # Minimum seconds between commands
+        self._last_command_time_ns = 0  # time.monotonic_ns() of the last queued command
+        self._command_rate_limit_ns = 200_000_000  # Minimum time between commands (0.2 s)
         self.last_command = None
         self.consecutive_stops = 0
         
+        # Reused compute_control() output (no per-tick allocation) and the
+        # input key it was computed from, for repeated vision input
+        self._out = ControlCommand()
+        self._last_key = None
+        
+        # Background HTTP worker (commands are fire-and-forget)
+        self._io_q = queue.Queue(maxsize=4)  # (generation, urls) bursts, None = exit
+        self._io_thread = None
+        self._io_generation = 0  # Bumped by _send_stop; older bursts are abandoned
+        
+    def _build_command_table(self):
+        """
+        Precompute the endpoint burst for every direction bit mask.
+        
+        Bits (low to high): up, down, left, right, yaw left, yaw right.
+        Opposite directions of an axis are never set together.
+        """
+        axes = (
+            ('move/up', 'move/down'),     # Vertical (highest priority)
+            ('move/left', 'move/right'),  # Lateral
+            ('yaw/left', 'yaw/right'),    # Yaw
+        )
+        table = {}
+        for vz_bits in (0, 1, 2):
+            for vy_bits in (0, 1, 2):
+                for yaw_bits in (0, 1, 2):
+                    commands = [pair[bits - 1]
+                                for pair, bits in zip(axes, (vz_bits, vy_bits, yaw_bits))
+                                if bits]
+                    mask = vz_bits | vy_bits << 2 | yaw_bits << 4
+                    table[mask] = tuple(self._endpoints[command]
+                                        for command in (commands or ['stop']))
+        return table
+    
+    @property
+    def command_rate_limit(self):
+        """Minimum time between commands, in seconds."""
+        return self._command_rate_limit_ns / 1e9
+    
+    @command_rate_limit.setter
+    def command_rate_limit(self, seconds):
+        self._command_rate_limit_ns = int(seconds * 1e9)
+    
+    @property
+    def last_command_time(self):
+        """time.monotonic() of the last queued command, in seconds (0 if none)."""
+        return self._last_command_time_ns / 1e9
+    
+    @last_command_time.setter
+    def last_command_time(self, seconds):
+        self._last_command_time_ns = int(seconds * 1e9)
+    
     def enable(self):
         """Enable autopilot."""
         self.enabled = True
         self.emergency_stop = False
+        self._last_key = None
+        self._start_io_worker()
         print("✓ Autopilot ENABLED")
         
     def disable(self):
@@ -88,133 +409,186 @@ class AutopilotController:
         self.enabled = False
         self._send_stop()
         self._clear_history()
+        self._last_key = None
         print("✓ Autopilot DISABLED")
         
     def trigger_emergency_stop(self):
         """Trigger emergency stop."""
         self.emergency_stop = True
         self.enabled = False
-        self._send_stop()
+        self._send_stop()  # Never blocks on the worker (runs on the vision path)
         print("🛑 EMERGENCY STOP TRIGGERED")
         
+    def _start_io_worker(self):
+        """Start the background HTTP worker if it is not running."""
+        if self._io_thread is None or not self._io_thread.is_alive():
+            self._io_thread = threading.Thread(target=self._io_worker, daemon=True)
+            self._io_thread.start()
+    
+    def _stop_io_worker(self):
+        """
+        Let the worker flush queued commands, then stop it (used by close()).
+        
+        The thread reference is kept until the worker has really exited, so
+        a later _start_io_worker() can never run two workers side by side.
+        """
+        if self._io_thread is not None and self._io_thread.is_alive():
+            self._io_q.put(None)  # Sentinel
+            self._io_thread.join(timeout=2.0)
+        if self._io_thread is not None and not self._io_thread.is_alive():
+            self._io_thread = None
+    
+    def _drain_io_queue(self):
+        """Drop commands that have been queued but not yet sent."""
+        try:
+            while True:
+                self._io_q.get_nowait()
+        except queue.Empty:
+            pass
+    
+    def _io_worker(self):
+        """Send queued API request bursts one at a time (preserves command order)."""
+        while True:
+            item = self._io_q.get()
+            if item is None:
+                break
+            generation, urls = item
+            for url in urls:
+                if generation != self._io_generation:
+                    break  # A stop was issued: drop the rest of this burst
+                self._post(url)
+    
+    def _post(self, url):
+        """
+        POST to a drone API endpoint and log failures.
+        
+        Returns:
+            bool: True if the API answered 200
+        """
+        try:
+            response = self._session.post(url, timeout=1.0)
+            
+            if response.status_code == 200:
+                return True
+            else:
+                print(f"✗ API error: {response.status_code}")
+                return False
+                
+        except requests.exceptions.Timeout:
+            print("✗ API timeout")
+            return False
+        except requests.exceptions.ConnectionError:
+            print("✗ Cannot connect to API (port 9000) - is Android app running?")
+            print("   Run: adb forward tcp:9000 tcp:9000")
+            return False
+        except Exception as e:
+            print(f"✗ Command error: {e}")
+            return False
+        
     def _clear_history(self):
         """Clear command history."""
-        self.vx_history.clear()
-        self.vy_history.clear()
-        self.vz_history.clear()
-        self.yaw_history.clear()
+        self._cmd_buf.fill(0.0)
+        self._cmd_sum.fill(0.0)
+        self._cmd_idx = 0
+        self._cmd_count = 0
         
     def compute_control(self, vision_result):
         """
         Compute control commands from vision analysis.
         
         Args:
-            vision_result: Output from obstacle detector
+            vision_result: VisionResult, or the obstacle detector result dict
             
         Returns:
-            dict with 'vx', 'vy', 'vz', 'yaw', 'action'
+            ControlCommand - the same instance on every call (overwritten in
+            place); copy it with dataclasses.replace() to keep values
         """
         if not self.enabled or self.emergency_stop:
-            return {'vx': 0, 'vy': 0, 'vz': 0, 'yaw': 0, 'action': 'STOPPED'}
+            return self._set_output('STOPPED')
         
-        # Extract metrics
-        balance = vision_result.get('balance')
-        if balance is None:
-            return {'vx': 0, 'vy': 0, 'vz': 0, 'yaw': 0, 'action': 'NO_VISION'}
-        
-        lateral_balance = balance['lateral_balance']
-        flow_mag = vision_result['flow_magnitude']
-        danger_level = vision_result['danger_level']
-        safe_dirs = vision_result['safe_directions']
-        
-        # Initialize commands
-        vx = 0.0  # forward/back
-        vy = 0.0  # left/right
-        vz = 0.0  # up/down
-        yaw = 0.0  # rotation
-        action = 'CRUISE'
+        # Extract metrics (legacy dict results are converted once)
+        vr = vision_result
+        if isinstance(vr, dict):
+            vr = VisionResult.from_dict(vr)
+        if vr is None:
+            return self._set_output('NO_VISION')
         
         # Check for emergency situations
-        if danger_level >= 3 or not safe_dirs.get('forward', True):
+        if vr.danger_level >= 3 or not vr.fwd_safe:
             # EMERGENCY STOP
             self.consecutive_stops += 1
             if self.consecutive_stops >= 3:
                 self.trigger_emergency_stop()
-                return {'vx': 0, 'vy': 0, 'vz': 0, 'yaw': 0, 'action': 'EMERGENCY'}
-            return {'vx': 0, 'vy': 0, 'vz': 0, 'yaw': 0, 'action': 'STOP'}
+                return self._set_output('EMERGENCY', balance=vr.lateral_balance,
+                                        flow=vr.flow_magnitude, danger=vr.danger_level)
+            return self._set_output('STOP', balance=vr.lateral_balance,
+                                    flow=vr.flow_magnitude, danger=vr.danger_level)
         
         self.consecutive_stops = 0
         
-        # Lateral balance control (bee navigation)
-        # Negative balance = right side has more flow -> move LEFT (positive vy)
-        # Positive balance = left side has more flow -> move RIGHT (negative vy)
-        vy = -lateral_balance * self.balance_gain
-        
-        # Apply deadband
-        if abs(vy) < self.deadband:
-            vy = 0.0
-        
-        # Forward speed control based on flow magnitude
-        # If flow is low, we can move forward
-        # If flow is high, slow down or stop
-        flow_error = (flow_mag - self.target_flow) / (self.target_flow + 0.01)
-        
-        if flow_mag < self.target_flow * 0.5:
-            # Very low flow, safe to move forward at slow speed
-            vx = 0.2
-            action = 'FORWARD_SLOW'
-        elif flow_mag < self.target_flow * 1.2:
-            # Good flow, maintain slow forward speed
-            vx = 0.15 - (flow_error * self.speed_gain)
-            action = 'CRUISE'
-        elif flow_mag < self.target_flow * 1.5:
-            # Flow getting high, slow down
-            vx = max(0, 0.1 - flow_error * self.speed_gain)
-            action = 'SLOWING'
-        else:
-            # Flow too high, stop
-            vx = 0.0
-            action = 'TOO_FAST'
-        
-        # Obstacle avoidance adjustments
-        if danger_level >= 1:
-            # Reduce speed when obstacles detected
-            vx *= 0.5
-            action = 'OBSTACLE_CAUTION'
-            
-        if danger_level >= 2:
-            # Stop forward motion, focus on avoiding
-            vx = 0.0
-            action = 'OBSTACLE_AVOID'
-            
-            # Increase lateral correction
-            vy *= 1.5
-            
-            # If still blocked after correction, try vertical
-            if not safe_dirs.get('left', True) and not safe_dirs.get('right', True):
-                if safe_dirs.get('up', True):
-                    vz = 0.15
-                    action = 'OBSTACLE_CLIMB'
-                elif safe_dirs.get('down', True):
-                    vz = -0.10
-                    action = 'OBSTACLE_DESCEND'
-        
-        # Clamp to safety limits
-        vx = np.clip(vx, self.min_vx, self.max_vx)
-        vy = np.clip(vy, -self.max_vy, self.max_vy)
-        vz = np.clip(vz, -self.max_vz, self.max_vz)
-        yaw = np.clip(yaw, -self.max_yaw, self.max_yaw)
+        # Vision often republishes the same result; skip recomputing it
+        key = (round(vr.lateral_balance, 3), round(vr.flow_magnitude, 3)) + vr[2:]
+        if key == self._last_key:
+            return self._out
         
-        return {
-            'vx': vx,
-            'vy': vy,
-            'vz': vz,
-            'yaw': yaw,
-            'action': action,
-            'balance': lateral_balance,
-            'flow': flow_mag,
-            'danger': danger_level
-        }
+        vx, vy, vz, yaw, action_code = _compute_core(
+            float(vr.lateral_balance), float(vr.flow_magnitude), int(vr.danger_level),
+            bool(vr.left_safe), bool(vr.right_safe), bool(vr.up_safe), bool(vr.down_safe),
+            self.balance_gain, self.speed_gain, self.target_flow, self.deadband,
+            self.min_vx, self.max_vx, self.max_vy, self.max_vz, self.max_yaw
+        )
+        
+        return self._set_output(ACTION_NAMES[action_code], vx, vy, vz, yaw,
+                                vr.lateral_balance, vr.flow_magnitude, vr.danger_level,
+                                key=key)
+    
+    def _set_output(self, action, vx=0.0, vy=0.0, vz=0.0, yaw=0.0,
+                    balance=0.0, flow=0.0, danger=0, key=None):
+        """Overwrite the reused output command and record its memo key."""
+        out = self._out
+        out.vx = vx
+        out.vy = vy
+        out.vz = vz
+        out.yaw = yaw
+        out.action = action
+        out.balance = balance
+        out.flow = flow
+        out.danger = danger
+        self._last_key = key
+        return out
+    
+    def compute_control_batch(self, balance_arr, flow_arr, danger_arr, safe_arr):
+        """
+        Compute control commands for a sequence of vision results in one sweep.
+        
+        Replays the compute_control() state machine (starting with no prior
+        stops) without changing controller state or triggering an emergency
+        stop. Useful for demo/replay runs and offline checks.
+        
+        Args:
+            balance_arr: (N,) lateral balance values
+            flow_arr: (N,) flow magnitudes
+            danger_arr: (N,) danger levels
+            safe_arr: (N, 5) safe-direction flags in SAFE_DIRECTIONS order
+            
+        Returns:
+            commands: (N, 4) array of [vx, vy, vz, yaw]
+            actions: list of N action names
+        """
+        n = len(balance_arr)
+        if not self.enabled or self.emergency_stop:
+            return np.zeros((n, 4)), ['STOPPED'] * n
+        
+        commands, action_codes = _compute_core_batch(
+            np.asarray(balance_arr, dtype=np.float64),
+            np.asarray(flow_arr, dtype=np.float64),
+            np.asarray(danger_arr, dtype=np.int64),
+            np.asarray(safe_arr, dtype=np.bool_).reshape(n, len(SAFE_DIRECTIONS)),
+            float(self.balance_gain), float(self.speed_gain), float(self.target_flow),
+            float(self.deadband), float(self.min_vx), float(self.max_vx),
+            float(self.max_vy), float(self.max_vz), float(self.max_yaw)
+        )
+        return commands, [ACTION_NAMES[code] for code in action_codes]
     
     def _smooth_commands(self, vx, vy, vz, yaw):
         """
@@ -226,94 +600,131 @@ class AutopilotController:
         Returns:
             vx_smooth, vy_smooth, vz_smooth, yaw_smooth: Smoothed commands
         """
-        # Add to history
-        self.vx_history.append(vx)
-        self.vy_history.append(vy)
-        self.vz_history.append(vz)
-        self.yaw_history.append(yaw)
-        
-        # Compute moving average
-        vx_smooth = np.mean(self.vx_history) if len(self.vx_history) > 0 else 0
-        vy_smooth = np.mean(self.vy_history) if len(self.vy_history) > 0 else 0
-        vz_smooth = np.mean(self.vz_history) if len(self.vz_history) > 0 else 0
-        yaw_smooth = np.mean(self.yaw_history) if len(self.yaw_history) > 0 else 0
+        (vx_smooth, vy_smooth, vz_smooth, yaw_smooth,
+         self._cmd_idx, self._cmd_count) = _smooth_core(
+            self._cmd_buf, self._cmd_sum, self._cmd_idx, self._cmd_count,
+            float(vx), float(vy), float(vz), float(yaw)
+        )
         
         return vx_smooth, vy_smooth, vz_smooth, yaw_smooth
     
-    def execute_control(self, control_cmd, confirm=None):
+    def execute_control(self, control_cmd, confirm=None, refresh=None):
         """
         Execute control command (with optional confirmation).
         
         Args:
-            control_cmd: Command dict from compute_control()
+            control_cmd: ControlCommand from compute_control()
             confirm: If None, use self.confirmation_mode. If True/False, override.
+            refresh: Optional callable returning a fresh ControlCommand (e.g.
+                compute_control() on the latest vision result). Called when
+                the user answers so the command sent matches current vision;
+                if the action changed, the user is asked again.
             
         Returns:
-            bool: True if command was sent, False if skipped
+            bool: True if the command was queued for the HTTP worker, False if
+            skipped. The POST itself runs on the worker, which logs failures;
+            last_command / last_command_time record the queued command.
         """
         if not self.enabled or self.emergency_stop:
             return False
         
         # Rate limiting
-        current_time = time.time()
-        if current_time - self.last_command_time < self.command_rate_limit:
+        current_time = time.monotonic_ns()
+        if current_time - self._last_command_time_ns < self._command_rate_limit_ns:
             return False
         
-        # Extract and smooth commands
-        vx, vy, vz, yaw = self._smooth_commands(
-            control_cmd['vx'],
-            control_cmd['vy'],
-            control_cmd['vz'],
-            control_cmd['yaw']
-        )
-        
         # Check if confirmation required
         need_confirm = confirm if confirm is not None else self.confirmation_mode
         
         if need_confirm:
-            # Display command and wait for confirmation
-            print("\n" + "="*50)
-            print(f"📋 AUTOPILOT COMMAND: {control_cmd['action']}")
-            print(f"   Forward: {vx:+.2f} m/s")
-            print(f"   Lateral: {vy:+.2f} m/s  {'← LEFT' if vy > 0 else '→ RIGHT' if vy < 0 else '⊙ CENTER'}")
-            print(f"   Vertical: {vz:+.2f} m/s")
-            print(f"   Yaw: {yaw:+.1f} °/s")
-            print(f"   Balance: {control_cmd['balance']:+.2f}")
-            print(f"   Flow: {control_cmd['flow']:.2f} px/frame")
-            print(f"   Danger: {control_cmd['danger']}/5")
-            print("="*50)
-            
-            response = input("Execute? [y/N/stop]: ").strip().lower()
-            
-            if response == 'stop':
-                self.trigger_emergency_stop()
-                return False
-            elif response != 'y':
-                print("⊘ Command skipped")
-                return False
+            while True:
+                # Display command and wait for confirmation
+                shown_action = control_cmd.action
+                self._print_confirmation(control_cmd, *self._preview_smoothing(
+                    control_cmd.vx, control_cmd.vy, control_cmd.vz, control_cmd.yaw
+                ))
+                
+                response = input("Execute? [y/N/stop]: ").strip().lower()
+                
+                if response == 'stop':
+                    self.trigger_emergency_stop()
+                    return False
+                elif response != 'y':
+                    print("⊘ Command skipped")
+                    return False
+                
+                if refresh is None:
+                    break
+                
+                # Re-evaluate against the vision data available now
+                latest = refresh()
+                if not self.enabled or self.emergency_stop:
+                    return False
+                if latest is None:
+                    break
+                control_cmd = latest
+                if latest.action == shown_action:
+                    break
+                
+                print(f"↻ Vision changed while waiting: {shown_action} → {latest.action}")
+        
+        # Extract and smooth commands
+        vx, vy, vz, yaw = self._smooth_commands(
+            control_cmd.vx,
+            control_cmd.vy,
+            control_cmd.vz,
+            control_cmd.yaw
+        )
         
         # Send command to drone
         success = self._send_velocity_command(vx, vy, vz, yaw)
         
         if success:
-            self.last_command_time = current_time
-            self.last_command = control_cmd
+            self._last_command_time_ns = current_time
+            self.last_command = replace(control_cmd)  # Snapshot (output buffer is reused)
             
             if not need_confirm:
                 # Silent mode - just show brief status
-                status = f"✈ {control_cmd['action']:15s} | "
+                status = f"✈ {control_cmd.action:15s} | "
                 status += f"Fwd:{vx:+.2f} Lat:{vy:+.2f} | "
-                status += f"Bal:{control_cmd['balance']:+.2f} Flow:{control_cmd['flow']:.1f}"
+                status += f"Bal:{control_cmd.balance:+.2f} Flow:{control_cmd.flow:.1f}"
                 print(status)
         
         return success
     
+    def _preview_smoothing(self, vx, vy, vz, yaw):
+        """Smoothed commands _smooth_commands() would return, without recording them."""
+        new = np.array([vx, vy, vz, yaw], dtype=np.float64)
+        total = self._cmd_sum + new
+        count = self._cmd_count + 1
+        if self._cmd_count == self.command_history_size:
+            total -= self._cmd_buf[self._cmd_idx]
+            count -= 1
+        return (total / count).tolist()
+    
+    def _print_confirmation(self, control_cmd, vx, vy, vz, yaw):
+        """Print the command confirmation banner (one write + flush)."""
+        sys.stdout.write(self._CONFIRM_TEMPLATE.format_map({
+            'action': control_cmd.action,
+            'vx': vx,
+            'vy': vy,
+            'vz': vz,
+            'yaw': yaw,
+            'arrow': self._LATERAL_ARROWS[(vy > 0) - (vy < 0) + 1],
+            'balance': control_cmd.balance,
+            'flow': control_cmd.flow,
+            'danger': control_cmd.danger,
+        }))
+        sys.stdout.flush()
+    
     def _send_velocity_command(self, vx, vy, vz, yaw_rate):
         """
-        Send velocity command to drone API.
+        Queue velocity command for the drone API.
         
         NOTE: The HS260 API doesn't support direct velocity control.
         This method converts velocity commands to discrete directional commands.
+        The HTTP request is sent by the background worker, so this returns
+        without waiting for the API to respond.
         
         Args:
             vx: Forward velocity (m/s) - NOT SUPPORTED, will be 0
@@ -322,79 +733,76 @@ class AutopilotController:
             yaw_rate: Yaw rate (deg/s) - converted to yaw left/right
             
         Returns:
-            bool: True if successful
+            bool: True if the command was queued, False if the worker is backed up
         """
+        urls = self._command_urls(vy, vz, yaw_rate)
+        
+        self._start_io_worker()
         try:
-            # HS260 API only supports discrete commands, not continuous velocity
-            # We need to send the appropriate directional command based on velocities
-            
-            commands = []
-            
-            # Vertical control (priority: altitude changes are most important)
-            if abs(vz) > self.deadband:
-                if vz > 0:
-                    commands.append('move/up')
-                else:
-                    commands.append('move/down')
-            
-            # Lateral control (left/right)
-            if abs(vy) > self.deadband:
-                if vy > 0:
-                    commands.append('move/left')
-                else:
-                    commands.append('move/right')
-            
-            # Yaw control
-            if abs(yaw_rate) > 5.0:  # deg/s threshold
-                if yaw_rate > 0:
-                    commands.append('yaw/left')
-                else:
-                    commands.append('yaw/right')
-            
-            # Note: Forward/backward (vx) not supported by HS260 API
-            # The drone can only move laterally and vertically, not forward/backward
-            
-            # If no movement, send stop
-            if not commands:
-                response = requests.post(
-                    f"{self.api_url}/api/stop",
-                    timeout=1.0
-                )
-                return response.status_code == 200
-            
-            # Send first command (API only allows one at a time)
-            # Priority: vertical > lateral > yaw
-            response = requests.post(
-                f"{self.api_url}/api/{commands[0]}",
-                timeout=1.0
-            )
-            
-            if response.status_code == 200:
-                return True
-            else:
-                print(f"✗ API error: {response.status_code}")
-                return False
-                
-        except requests.exceptions.Timeout:
-            print("✗ API timeout")
-            return False
-        except requests.exceptions.ConnectionError:
-            print("✗ Cannot connect to API (port 9000) - is Android app running?")
-            print("   Run: adb forward tcp:9000 tcp:9000")
-            return False
-        except Exception as e:
-            print(f"✗ Command error: {e}")
+            self._io_q.put_nowait((self._io_generation, urls))
+            return True
+        except queue.Full:
+            print("✗ API busy - command dropped")
             return False
     
+    def _command_urls(self, vy, vz, yaw_rate):
+        """
+        Convert velocities to the burst of directional endpoint URLs.
+        
+        Returns:
+            tuple of URLs in priority order (vertical > lateral > yaw),
+            or the stop URL if no velocity exceeds its deadband
+        """
+        # HS260 API only supports discrete commands, not continuous velocity
+        # We need to send the appropriate directional command based on velocities
+        
+        # One bit per direction: vz up/down, vy left/right, yaw left/right.
+        # The precomputed table maps each mask to its URL burst, in priority
+        # order (vertical > lateral > yaw), or to stop if no bit is set.
+        # Note: Forward/backward (vx) not supported by HS260 API
+        deadband = self.deadband
+        yaw_deadband = self.yaw_deadband
+        mask = ((vz > deadband) | (vz < -deadband) << 1 |
+                (vy > deadband) << 2 | (vy < -deadband) << 3 |
+                (yaw_rate > yaw_deadband) << 4 | (yaw_rate < -yaw_deadband) << 5)
+        return self._command_table[mask]
+    
     def _send_stop(self):
-        """Send stop command to drone."""
-        try:
-            requests.post(
-                f"{self.api_url}/api/drone/stop",
-                timeout=1.0
-            )
-        except:
-            pass
+        """
+        Send stop command to drone, preempting pending commands.
+        
+        Queued bursts are dropped and the burst in flight is abandoned after
+        its current request, so stop goes out right after that one POST.
+        """
+        url = self._endpoints['drone/stop']
+        self._io_generation += 1
+        self._drain_io_queue()
+        
+        if self._io_thread is not None and self._io_thread.is_alive():
+            # Queue behind the in-flight request so stop is always sent last
+            try:
+                self._io_q.put((self._io_generation, (url,)), timeout=1.0)
+                return
+            except queue.Full:
+                pass
+        
+        self._post(url)
+    
+    def get_command_history(self):
+        """
+        Get recent commands in chronological order.
+        
+        Returns:
+            (count, 4) array of [vx, vy, vz, yaw] rows, oldest first
+        """
+        if self._cmd_count < self.command_history_size:
+            return self._cmd_buf[:self._cmd_count].copy()
+        return np.roll(self._cmd_buf, -self._cmd_idx, axis=0)
+    
+    def close(self):
+        """Stop the HTTP worker and release pooled connections."""
+        self._stop_io_worker()
+        self._session.close()
     
     def get_status(self):
         """Get autopilot status."""
@@ -403,5 +811,156 @@ class AutopilotController:
             'emergency_stop': self.emergency_stop,
             'confirmation_mode': self.confirmation_mode,
             'last_command': self.last_command,
-            'command_count': len(self.vx_history)
+            'command_count': self._cmd_count,
+            'command_history': self.get_command_history()
         }
+
+
+class AsyncAutopilotController(AutopilotController):
+    """
+    Autopilot controller with asyncio HTTP transport (aiohttp).
+    
+    Same control logic as AutopilotController, but API requests are sent by
+    a task on the running event loop over one aiohttp session, so
+    an asyncio pipeline (e.g. H264StreamDecoder) never blocks on HTTP or
+    needs an extra thread. Commands are still sent one at a time in order.
+    
+    Confirmation mode is not supported: input() would block the event loop.
+    
+    Usage (inside a coroutine):
+        autopilot = AsyncAutopilotController()
+        autopilot.enable()
+        async for frame in decoder.receive_frames():
+            result = detector.analyze_frame(frame)
+            autopilot.execute_control(autopilot.compute_control(result))
+        autopilot.disable()
+        await autopilot.aclose()
+    """
+    
+    def __init__(self, api_url="http://localhost:9000", command_history_size=5):
+        """
+        Initialize async autopilot controller.
+        
+        Args:
+            api_url: Base URL for drone control API
+            command_history_size: Number of commands to average for smoothing
+        """
+        if aiohttp is None:
+            raise ImportError("AsyncAutopilotController requires aiohttp (pip install aiohttp)")
+        
+        super().__init__(api_url=api_url, confirmation_mode=False,
+                         command_history_size=command_history_size)
+        
+        self._io_q = asyncio.Queue(maxsize=4)
+        self._io_task = None
+        self._aio_session = None
+    
+    def _start_io_worker(self):
+        """Start the sender task on the running event loop."""
+        if self._io_task is None or self._io_task.done():
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return  # No event loop (stop falls back to a blocking POST)
+            self._io_task = loop.create_task(self._io_worker_async())
+    
+    def _stop_io_worker(self):
+        """Ask the sender task to exit once queued commands are sent."""
+        if self._io_task is not None and not self._io_task.done():
+            try:
+                self._io_q.put_nowait(None)  # Sentinel
+            except asyncio.QueueFull:
+                self._io_task.cancel()
+    
+    def _drain_io_queue(self):
+        """Drop commands that have been queued but not yet sent."""
+        try:
+            while True:
+                self._io_q.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+    
+    def _send_velocity_command(self, vx, vy, vz, yaw_rate):
+        """Queue velocity command for the sender task (see base class)."""
+        urls = self._command_urls(vy, vz, yaw_rate)
+        
+        self._start_io_worker()
+        try:
+            self._io_q.put_nowait((self._io_generation, urls))
+            return True
+        except asyncio.QueueFull:
+            print("✗ API busy - command dropped")
+            return False
+    
+    def _send_stop(self):
+        """Send stop command to drone, preempting pending commands (see base class)."""
+        url = self._endpoints['drone/stop']
+        self._io_generation += 1
+        self._drain_io_queue()
+        
+        if self._io_task is not None and not self._io_task.done():
+            # Queue behind the in-flight request so stop is always sent last
+            self._io_q.put_nowait((self._io_generation, (url,)))
+        else:
+            self._post(url)
+    
+    async def _io_worker_async(self):
+        """Send queued API request bursts one at a time (preserves command order)."""
+        if self._aio_session is None:
+            self._aio_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=4, force_close=True)  # Server closes after each response
+            )
+        
+        while True:
+            item = await self._io_q.get()
+            if item is None:
+                break
+            generation, urls = item
+            for url in urls:
+                if generation != self._io_generation:
+                    break  # A stop was issued: drop the rest of this burst
+                await self._post_async(url)
+    
+    async def _post_async(self, url):
+        """
+        POST to a drone API endpoint and log failures.
+        
+        Returns:
+            bool: True if the API answered 200
+        """
+        try:
+            async with self._aio_session.post(
+                url, timeout=aiohttp.ClientTimeout(total=1.0)
+            ) as response:
+                if response.status == 200:
+                    return True
+                else:
+                    print(f"✗ API error: {response.status}")
+                    return False
+                    
+        except asyncio.TimeoutError:
+            print("✗ API timeout")
+            return False
+        except aiohttp.ClientConnectionError:
+            print("✗ Cannot connect to API (port 9000) - is Android app running?")
+            print("   Run: adb forward tcp:9000 tcp:9000")
+            return False
+        except Exception as e:
+            print(f"✗ Command error: {e}")
+            return False
+    
+    async def aclose(self):
+        """Flush queued commands, then close both HTTP sessions."""
+        self._stop_io_worker()
+        if self._io_task is not None:
+            try:
+                await self._io_task
+            except asyncio.CancelledError:
+                pass
+            self._io_task = None
+        
+        if self._aio_session is not None:
+            await self._aio_session.close()
+            self._aio_session = None
+        
+        self._session.close()
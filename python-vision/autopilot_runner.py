@@ -7,12 +7,8 @@ Connects to vision server and runs autopilot with manual confirmation mode.
 
 import sys
 import time
-import threading
-from autopilot import AutopilotController
-
-# Shared vision result (will be updated from vision_server)
-latest_vision_result = None
-result_lock = threading.Lock()
+import numpy as np
+from autopilot import AutopilotController, ControlCommand, VisionResult
 
 
 def main():
@@ -84,50 +80,58 @@ def main():
     scenarios = [
         {
             'name': 'Scenario 1: Centered, low flow',
-            'vision': {
-                'balance': {'lateral_balance': 0.05},
-                'flow_magnitude': 1.5,
-                'danger_level': 0,
-                'safe_directions': {'forward': True, 'left': True, 'right': True, 'up': True, 'down': True}
-            }
+            'vision': VisionResult(
+                lateral_balance=0.05, flow_magnitude=1.5, danger_level=0,
+                fwd_safe=True, left_safe=True, right_safe=True, up_safe=True, down_safe=True
+            )
         },
         {
             'name': 'Scenario 2: Drifting right (balance -0.45)',
-            'vision': {
-                'balance': {'lateral_balance': -0.45},
-                'flow_magnitude': 4.8,
-                'danger_level': 0,
-                'safe_directions': {'forward': True, 'left': True, 'right': True, 'up': True, 'down': True}
-            }
+            'vision': VisionResult(
+                lateral_balance=-0.45, flow_magnitude=4.8, danger_level=0,
+                fwd_safe=True, left_safe=True, right_safe=True, up_safe=True, down_safe=True
+            )
         },
         {
             'name': 'Scenario 3: Obstacle ahead',
-            'vision': {
-                'balance': {'lateral_balance': 0.10},
-                'flow_magnitude': 6.5,
-                'danger_level': 2,
-                'safe_directions': {'forward': False, 'left': True, 'right': True, 'up': True, 'down': True}
-            }
+            'vision': VisionResult(
+                lateral_balance=0.10, flow_magnitude=6.5, danger_level=2,
+                fwd_safe=False, left_safe=True, right_safe=True, up_safe=True, down_safe=True
+            )
         },
         {
             'name': 'Scenario 4: Corridor too narrow',
-            'vision': {
-                'balance': {'lateral_balance': -0.20},
-                'flow_magnitude': 8.2,
-                'danger_level': 3,
-                'safe_directions': {'forward': False, 'left': False, 'right': False, 'up': True, 'down': True}
-            }
+            'vision': VisionResult(
+                lateral_balance=-0.20, flow_magnitude=8.2, danger_level=3,
+                fwd_safe=False, left_safe=False, right_safe=False, up_safe=True, down_safe=True
+            )
         },
     ]
     
+    # Convert scenarios to arrays once and compute all commands in one sweep
+    visions = [scenario['vision'] for scenario in scenarios]
+    balance_arr = np.array([v.lateral_balance for v in visions])
+    flow_arr = np.array([v.flow_magnitude for v in visions])
+    danger_arr = np.array([v.danger_level for v in visions])
+    safe_arr = np.array([v[3:] for v in visions])  # forward, left, right, up, down
+    commands, actions = autopilot.compute_control_batch(
+        balance_arr, flow_arr, danger_arr, safe_arr
+    )
+    
     try:
         for i, scenario in enumerate(scenarios, 1):
             print(f"\n{'='*60}")
             print(f"  {scenario['name']}")
             print(f"{'='*60}")
             
-            # Compute control from simulated vision
-            control_cmd = autopilot.compute_control(scenario['vision'])
+            # Precomputed control for this scenario
+            vx, vy, vz, yaw = commands[i - 1]
+            control_cmd = ControlCommand(
+                vx, vy, vz, yaw, actions[i - 1],
+                balance_arr[i - 1], flow_arr[i - 1], danger_arr[i - 1]
+            )
+            if control_cmd.action == 'EMERGENCY':
+                autopilot.trigger_emergency_stop()
             
             # Execute with confirmation
             success = autopilot.execute_control(control_cmd)
@@ -151,6 +155,7 @@ def main():
     
     finally:
         autopilot.disable()
+        autopilot.close()
         print("\n✓ Autopilot disabled")
         print("\nDemo complete!")
 
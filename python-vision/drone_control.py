@@ -10,21 +10,35 @@ Usage:
 """
 
 import requests
-import json
 import sys
 import time
 
+try:
+    import orjson  # Optional: faster JSON decoding
+    json_loads = orjson.loads
+except ImportError:
+    import json
+    json_loads = json.loads
+
 
 API_BASE = "http://localhost:9000"
 
+# Shared session for all API calls. The API server closes the socket after
+# every response, so don't let the pool hand out a dead keep-alive connection
+SESSION = requests.Session()
+SESSION.headers['Connection'] = 'close'
+
 
 def calibrate_gyro():
     """Calibrate gyro before takeoff."""
     print("🔧 Calibrating gyro...")
     try:
-        response = requests.post(f"{API_BASE}/api/calibrate", timeout=5)
-        result = response.json()
-        print(f"✅ {result.get('message', 'Calibration complete')}")
+        # Only the status code matters; closing returns the connection to the pool
+        with SESSION.post(f"{API_BASE}/api/calibrate", timeout=5) as response:
+            if not response.ok:
+                print(f"❌ Calibration failed: HTTP {response.status_code}")
+                return False
+        print("✅ Calibration complete")
         return True
     except Exception as e:
         print(f"❌ Calibration failed: {e}")
@@ -50,10 +64,12 @@ def takeoff():
     # Step 2: Takeoff
     print("\n📋 Step 2: Taking off...")
     try:
-        response = requests.post(f"{API_BASE}/api/takeoff", timeout=5)
-        result = response.json()
+        with SESSION.post(f"{API_BASE}/api/takeoff", timeout=5) as response:
+            if not response.ok:
+                print(f"❌ Takeoff failed: HTTP {response.status_code}")
+                return False
         print(f"✅ Takeoff command sent")
-        print(f"   Status: {result.get('status', 'success')}")
+        print(f"   Status: HTTP {response.status_code}")
         
         print("\n⚠️  IMPORTANT:")
         print("   - Keep clear of propellers")
@@ -71,10 +87,12 @@ def land():
     """Land the drone."""
     print("🛬 Landing...")
     try:
-        response = requests.post(f"{API_BASE}/api/land", timeout=5)
-        result = response.json()
+        with SESSION.post(f"{API_BASE}/api/land", timeout=5) as response:
+            if not response.ok:
+                print(f"❌ Land failed: HTTP {response.status_code}")
+                return False
         print(f"✅ Land command sent")
-        print(f"   Status: {result.get('status', 'success')}")
+        print(f"   Status: HTTP {response.status_code}")
         return True
     except Exception as e:
         print(f"❌ Land failed: {e}")
@@ -84,8 +102,8 @@ def land():
 def get_status():
     """Get drone status."""
     try:
-        response = requests.get(f"{API_BASE}/api/status", timeout=2)
-        status = response.json()
+        with SESSION.get(f"{API_BASE}/api/status", timeout=2) as response:
+            status = json_loads(response.content)
         
         print("=" * 50)
         print("🚁 DRONE STATUS")
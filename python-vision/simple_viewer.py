@@ -12,88 +12,148 @@ import numpy as np
 import cv2
 import time
 import sys
+from av.video.reformatter import VideoReformatter
+
+from vision.stream_decoder import create_codec, create_hwaccel, luma_plane
+
+
+_RESET_DECODER = object()  # Decoder-queue marker: new stream, start a fresh decoder
+RECONNECT_DELAY = 2.0  # Seconds between WebSocket reconnect attempts
 
 
 class SimpleVideoViewer:
     """Simple threaded video viewer."""
     
-    def __init__(self, url="ws://localhost:9000/stream", grayscale=False):
+    def __init__(self, url="ws://localhost:9000/stream", grayscale=False, hwaccel=True):
         self.url = url
         self.grayscale = grayscale
-        self.frame_queue = queue.Queue(maxsize=30)
+        self.hwaccel = create_hwaccel() if hwaccel else None
+        self._reformatter = VideoReformatter()  # Reuses one swscale context for all frames
+        self.frame_queue = queue.Queue(maxsize=1)  # Latest decoded frame only
+        self._nal_queue = queue.Queue(maxsize=60)  # Raw NAL units from socket
         self.running = False
-        self.codec = None
+        self._connected_once = False
+        self._ws = None
+        self._quit = threading.Event()  # Set when the viewer exits (stops reconnecting)
+        self.codec = self._create_codec()  # Configured before any data arrives
         self.fps = 0.0
         self.frame_count = 0
         self.last_fps_time = time.time()
         
+    def _create_codec(self):
+        """Create the H.264 decoder (see create_codec), tuned for low latency."""
+        codec, self.hwaccel = create_codec(self.hwaccel)
+        
+        # Slice/frame threading across all cores (0 = let FFmpeg pick)
+        codec.thread_type = 'AUTO'
+        codec.thread_count = 0
+        codec.flags |= av.codec.context.Flags.low_delay  # Don't buffer frames
+        print("✓ H.264 decoder initialized")
+        return codec
+    
+    def _reset_decoder(self):
+        """Replace the decoder so a new stream starts from clean SPS/PPS state."""
+        self.codec = self._create_codec()
+    
     def _on_message(self, ws, message):
-        """WebSocket message handler."""
+        """WebSocket message handler - hands NAL units to the decoder thread."""
         try:
-            # Decode NAL unit
-            if self.codec is None:
-                self.codec = av.CodecContext.create('h264', 'r')
-                print("✓ H.264 decoder initialized")
-            
-            packet = av.Packet(message)
-            frames = self.codec.decode(packet)
+            self._nal_queue.put_nowait(message)
+        except queue.Full:
+            pass  # Decoder is behind, drop this NAL unit
+    
+    def _decode_loop(self):
+        """Decoder thread: decode queued NAL units and publish frames."""
+        while True:
+            message = self._nal_queue.get()
+            if message is None:
+                break
+            if message is _RESET_DECODER:
+                self._reset_decoder()
+                continue
             
-            for frame in frames:
-                img = frame.to_ndarray(format='rgb24')
-                
-                if self.grayscale:
-                    img = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-                else:
-                    img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+            try:
+                # Decode NAL unit
+                packet = av.Packet(message)
+                frames = self.codec.decode(packet)
                 
-                # Add to queue (drop old frames if full)
-                if self.frame_queue.full():
+                for frame in frames:
+                    # Convert straight to the display format (no extra cvtColor pass)
+                    if self.grayscale:
+                        img = luma_plane(frame)
+                    else:
+                        img = self._reformatter.reformat(frame, format='bgr24').to_ndarray()
+                    
+                    # Publish as the latest frame, replacing one not yet displayed
                     try:
-                        self.frame_queue.get_nowait()
-                    except:
-                        pass
-                self.frame_queue.put(img)
-                
-                # Update FPS
-                self.frame_count += 1
-                current_time = time.time()
-                if current_time - self.last_fps_time >= 1.0:
-                    self.fps = self.frame_count / (current_time - self.last_fps_time)
-                    self.frame_count = 0
-                    self.last_fps_time = current_time
-                
-        except Exception as e:
-            pass  # Ignore decode errors
+                        self.frame_queue.put_nowait(img)
+                    except queue.Full:
+                        try:
+                            self.frame_queue.get_nowait()
+                        except queue.Empty:
+                            pass
+                        self.frame_queue.put_nowait(img)  # Only this thread puts
+                    
+                    # Update FPS
+                    self.frame_count += 1
+                    current_time = time.time()
+                    if current_time - self.last_fps_time >= 1.0:
+                        self.fps = self.frame_count / (current_time - self.last_fps_time)
+                        self.frame_count = 0
+                        self.last_fps_time = current_time
+                    
+            except Exception as e:
+                pass  # Ignore decode errors
     
     def _on_error(self, ws, error):
         """WebSocket error handler."""
         print(f"✗ WebSocket error: {error}")
     
     def _on_close(self, ws, close_status_code, close_msg):
-        """WebSocket close handler."""
-        print("WebSocket connection closed")
-        self.running = False
+        """WebSocket close handler (the viewer keeps running and reconnects)."""
+        if not self._quit.is_set():
+            print(f"WebSocket connection closed, reconnecting in {RECONNECT_DELAY:.0f}s...")
     
     def _on_open(self, ws):
         """WebSocket open handler."""
         print("✓ Connected to video stream")
+        if self._connected_once:
+            # Reconnected: drop old-stream NAL units and reset the decoder in order
+            self._drain_nal_queue()
+            self._nal_queue.put(_RESET_DECODER)
+        self._connected_once = True
         self.running = True
     
+    def _drain_nal_queue(self):
+        """Discard queued NAL units."""
+        while True:
+            try:
+                self._nal_queue.get_nowait()
+            except queue.Empty:
+                break
+    
     def _websocket_thread(self):
-        """WebSocket receive thread."""
-        ws = websocket.WebSocketApp(
+        """WebSocket receive thread (reconnects until the viewer exits)."""
+        self._ws = websocket.WebSocketApp(
             self.url,
             on_open=self._on_open,
             on_message=self._on_message,
             on_error=self._on_error,
             on_close=self._on_close
         )
-        ws.run_forever()
+        while not self._quit.is_set():
+            # reconnect= retries dropped connections; the loop covers clean closes
+            self._ws.run_forever(reconnect=RECONNECT_DELAY)
+            self._quit.wait(RECONNECT_DELAY)
     
     def run(self):
         """Run the video viewer."""
         print(f"Connecting to {self.url}...")
         
+        # Start decoder thread (keeps decode work off the socket thread)
+        decoder_thread = threading.Thread(target=self._decode_loop, daemon=True)
+        decoder_thread.start()
+        
         # Start WebSocket thread
         ws_thread = threading.Thread(target=self._websocket_thread, daemon=True)
         ws_thread.start()
@@ -106,6 +166,9 @@ class SimpleVideoViewer:
         
         if not self.running:
             print("✗ Failed to connect to video stream")
+            self._quit.set()
+            if self._ws is not None:
+                self._ws.close()
             return
         
         print("\n=== CONTROLS ===")
@@ -120,50 +183,58 @@ class SimpleVideoViewer:
         try:
             while self.running:
                 try:
-                    # Get frame from queue (timeout to check for quit)
+                    # Take the latest frame (timeout to check for quit)
                     frame = self.frame_queue.get(timeout=0.1)
-                    
-                    if frames_displayed == 0:
-                        print(f"✓ First frame received: {frame.shape}")
-                        print(f"✓ OpenCV window should be visible now")
-                        print(f"  (Check your Dock or Mission Control if you don't see it)\n")
-                    
-                    frames_displayed += 1
-                    
-                    # Overlay FPS
-                    fps_text = f"FPS: {self.fps:.1f} | Press 'q' to quit"
-                    color = 255 if self.grayscale else (0, 255, 0)
-                    cv2.putText(frame, fps_text, (10, 30), 
-                               cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
-                    
-                    # Display frame
-                    cv2.imshow('HS260 Video Stream', frame)
-                    
-                    # Handle keyboard
-                    key = cv2.waitKey(1) & 0xFF
-                    if key == ord('q') or key == 27:  # q or ESC
-                        print("\nQuitting...")
-                        break
-                    elif key == ord('s'):
-                        filename = f"frame_{int(time.time())}.png"
-                        cv2.imwrite(filename, frame)
-                        print(f"Saved {filename}")
-                    
-                    # Print status
-                    if frames_displayed % 30 == 0:
-                        print(f"Frames: {frames_displayed}, FPS: {self.fps:.1f}")
-                    
                 except queue.Empty:
                     # No frame available, check if window was closed
                     if cv2.getWindowProperty('HS260 Video Stream', cv2.WND_PROP_VISIBLE) < 1:
                         print("\nWindow closed")
                         break
                     continue
-                    
+                
+                if frames_displayed == 0:
+                    print(f"✓ First frame received: {frame.shape}")
+                    print(f"✓ OpenCV window should be visible now")
+                    print(f"  (Check your Dock or Mission Control if you don't see it)\n")
+                
+                frames_displayed += 1
+                
+                # Overlay FPS
+                fps_text = f"FPS: {self.fps:.1f} | Press 'q' to quit"
+                color = 255 if self.grayscale else (0, 255, 0)
+                cv2.putText(frame, fps_text, (10, 30), 
+                           cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
+                
+                # Display frame
+                cv2.imshow('HS260 Video Stream', frame)
+                
+                # Handle keyboard
+                key = cv2.waitKey(1) & 0xFF
+                if key == ord('q') or key == 27:  # q or ESC
+                    print("\nQuitting...")
+                    break
+                elif key == ord('s'):
+                    filename = f"frame_{int(time.time())}.png"
+                    cv2.imwrite(filename, frame)
+                    print(f"Saved {filename}")
+                
+                # Print status
+                if frames_displayed % 30 == 0:
+                    print(f"Frames: {frames_displayed}, FPS: {self.fps:.1f}")
+                
         except KeyboardInterrupt:
             print("\n\nInterrupted by user (Ctrl+C)")
         finally:
             self.running = False
+            self._quit.set()
+            if self._ws is not None:
+                self._ws.close()
+            # Stop decoder thread (drop pending NAL units so the sentinel fits)
+            self._drain_nal_queue()
+            try:
+                self._nal_queue.put_nowait(None)
+            except queue.Full:
+                pass  # Daemon thread exits with the process
             cv2.destroyAllWindows()
             print(f"\nTotal frames displayed: {frames_displayed}")
             print(f"Final FPS: {self.fps:.1f}")
@@ -171,6 +242,7 @@ class SimpleVideoViewer:
 
 if __name__ == "__main__":
     grayscale = "--grayscale" in sys.argv or "-g" in sys.argv
+    hwaccel = "--no-hwaccel" not in sys.argv
     
     print("=== Simple H.264 Video Viewer ===")
     print("Make sure:")
@@ -178,5 +250,5 @@ if __name__ == "__main__":
     print("  2. Port forwarding: adb forward tcp:9000 tcp:9000")
     print("  3. Drone is connected\n")
     
-    viewer = SimpleVideoViewer(grayscale=grayscale)
+    viewer = SimpleVideoViewer(grayscale=grayscale, hwaccel=hwaccel)
     viewer.run()
@@ -13,6 +13,48 @@ Based on:
 import cv2
 import numpy as np
 
+from ..utils.jit import njit, NUMBA_AVAILABLE
+
+
+# Eager signatures: valid coords are np.nonzero views (intp), flow is float32
+# from OpenCV (float64 also accepted). Compiling at import avoids a
+# first-frame JIT stall and skips per-call type inference.
+_FOE_KERNEL_SIGNATURES = [
+    'UniTuple(float64, 3)(intp[:], intp[:], {0}[::1], {0}[::1], {0}[::1], float64)'.format(t)
+    for t in ('float32', 'float64')
+]
+
+
+@njit(_FOE_KERNEL_SIGNATURES, fastmath=True, boundscheck=False, cache=True)
+def _weighted_foe_kernel(valid_x, valid_y, valid_flow_x, valid_flow_y, valid_mag, trace_distance):
+    """Weighted FOE centroid and spread in two streaming passes over the valid points."""
+    n = valid_mag.shape[0]
+    total_mag = 0.0
+    for i in range(n):
+        total_mag += valid_mag[i]
+    total_mag += 1e-6
+    
+    # Pass 1: weighted mean of traced-back candidates
+    foe_x = 0.0
+    foe_y = 0.0
+    for i in range(n):
+        inv_mag = 1.0 / (valid_mag[i] + 1e-6)
+        cx = valid_x[i] - valid_flow_x[i] * inv_mag * trace_distance
+        cy = valid_y[i] - valid_flow_y[i] * inv_mag * trace_distance
+        weight = valid_mag[i] / total_mag
+        foe_x += cx * weight
+        foe_y += cy * weight
+    
+    # Pass 2: weighted variance around the mean
+    variance = 0.0
+    for i in range(n):
+        inv_mag = 1.0 / (valid_mag[i] + 1e-6)
+        ex = valid_x[i] - valid_flow_x[i] * inv_mag * trace_distance - foe_x
+        ey = valid_y[i] - valid_flow_y[i] * inv_mag * trace_distance - foe_y
+        variance += (valid_mag[i] / total_mag) * (ex * ex + ey * ey)
+    
+    return foe_x, foe_y, np.sqrt(variance)
+
 
 class FOEDetector:
     """Detect Focus of Expansion from optical flow field."""
@@ -30,13 +72,15 @@ class FOEDetector:
         self.foe = None
         self.confidence = 0.0
         
-    def estimate_foe(self, flow, method='weighted_average'):
+    def estimate_foe(self, flow, method='weighted_average', stride=4):
         """
         Estimate Focus of Expansion from optical flow.
         
         Args:
             flow: Optical flow field (H, W, 2)
             method: 'weighted_average' or 'least_squares'
+            stride: Subsampling step per axis (FOE is a statistical estimate,
+                1/stride^2 of the samples is plenty)
         
         Returns:
             foe: (x, y) tuple or None if estimation failed
@@ -45,23 +89,27 @@ class FOEDetector:
         if flow is None or flow.size == 0:
             return None, 0.0
         
+        # Subsample; FOE is scaled back to full-resolution pixels below
+        if stride > 1:
+            flow = flow[::stride, ::stride]
+        
         h, w = flow.shape[:2]
         
-        # Compute flow magnitude
+        # Filter by minimum magnitude (compare squared; sqrt only the survivors)
         flow_x = flow[..., 0]
         flow_y = flow[..., 1]
-        magnitude = np.sqrt(flow_x**2 + flow_y**2)
+        sq_magnitude = flow_x * flow_x + flow_y * flow_y
+        mask = sq_magnitude > self.min_flow_magnitude * self.min_flow_magnitude
         
-        # Filter by minimum magnitude
-        mask = magnitude > self.min_flow_magnitude
-        
-        if np.sum(mask) < 10:  # Need at least 10 valid points
+        if np.count_nonzero(mask) < 10:  # Need at least 10 valid points
             return None, 0.0
         
+        valid_mag = np.sqrt(sq_magnitude[mask])
+        
         if method == 'weighted_average':
-            foe, confidence = self._weighted_average_foe(flow_x, flow_y, magnitude, mask, w, h)
+            foe, confidence = self._weighted_average_foe(flow_x, flow_y, valid_mag, mask, w, h, stride)
         elif method == 'least_squares':
-            foe, confidence = self._least_squares_foe(flow_x, flow_y, magnitude, mask, w, h)
+            foe, confidence = self._least_squares_foe(flow_x, flow_y, valid_mag, mask, w, h, stride)
         else:
             raise ValueError(f"Unknown method: {method}")
         
@@ -70,7 +118,7 @@ class FOEDetector:
         
         return foe, confidence
     
-    def _weighted_average_foe(self, flow_x, flow_y, magnitude, mask, w, h):
+    def _weighted_average_foe(self, flow_x, flow_y, valid_mag, mask, w, h, stride=1):
         """
         Estimate FOE using weighted average of flow vector origins.
         
@@ -78,39 +126,42 @@ class FOEDetector:
         We trace back along the negative flow direction to find candidate FOE positions,
         then compute weighted average.
         """
-        # Create coordinate grids
-        yy, xx = np.mgrid[0:h, 0:w]
+        # Coordinates of valid flow vectors only (no full HxW grid)
+        valid_y, valid_x = np.nonzero(mask)
         
         # Get valid flow vectors
-        valid_x = xx[mask]
-        valid_y = yy[mask]
         valid_flow_x = flow_x[mask]
         valid_flow_y = flow_y[mask]
-        valid_mag = magnitude[mask]
-        
-        # Normalize flow directions
-        flow_dx = valid_flow_x / (valid_mag + 1e-6)
-        flow_dy = valid_flow_y / (valid_mag + 1e-6)
         
         # For expanding flow (moving forward), flow vectors point outward from FOE
         # So we trace back along negative flow direction
         # Distance to trace back: use a heuristic based on frame size
         trace_distance = min(w, h) / 2
         
-        foe_x_candidates = valid_x - flow_dx * trace_distance
-        foe_y_candidates = valid_y - flow_dy * trace_distance
-        
-        # Weight by magnitude (stronger flow = more reliable)
-        weights = valid_mag / (np.sum(valid_mag) + 1e-6)
-        
-        # Compute weighted average
-        foe_x = np.sum(foe_x_candidates * weights)
-        foe_y = np.sum(foe_y_candidates * weights)
-        
-        # Confidence based on agreement (low variance = high confidence)
-        variance_x = np.sum(weights * (foe_x_candidates - foe_x)**2)
-        variance_y = np.sum(weights * (foe_y_candidates - foe_y)**2)
-        variance = np.sqrt(variance_x + variance_y)
+        if NUMBA_AVAILABLE:
+            # Fused kernel: no per-op temporaries over the N valid points
+            foe_x, foe_y, variance = _weighted_foe_kernel(
+                valid_x, valid_y, valid_flow_x, valid_flow_y, valid_mag, trace_distance
+            )
+        else:
+            # Normalize flow directions
+            flow_dx = valid_flow_x / (valid_mag + 1e-6)
+            flow_dy = valid_flow_y / (valid_mag + 1e-6)
+            
+            foe_x_candidates = valid_x - flow_dx * trace_distance
+            foe_y_candidates = valid_y - flow_dy * trace_distance
+            
+            # Weight by magnitude (stronger flow = more reliable)
+            weights = valid_mag / (np.sum(valid_mag) + 1e-6)
+            
+            # Compute weighted average
+            foe_x = np.sum(foe_x_candidates * weights)
+            foe_y = np.sum(foe_y_candidates * weights)
+            
+            # Confidence based on agreement (low variance = high confidence)
+            variance_x = np.sum(weights * (foe_x_candidates - foe_x)**2)
+            variance_y = np.sum(weights * (foe_y_candidates - foe_y)**2)
+            variance = np.sqrt(variance_x + variance_y)
         
         # Normalize variance to confidence (0-1)
         # Low variance = high confidence
@@ -118,31 +169,28 @@ class FOEDetector:
         confidence = max(0.0, 1.0 - variance / max_expected_variance)
         
         # Check if FOE is within reasonable bounds (allow some outside frame)
-        margin = 0.3  # 30% margin outside frame
-        if (foe_x < -w*margin or foe_x > w*(1+margin) or 
-            foe_y < -h*margin or foe_y > h*(1+margin)):
+        if self._out_of_bounds(foe_x, foe_y, w, h):
             confidence *= 0.5  # Reduce confidence for out-of-frame FOE
         
-        foe = (int(foe_x), int(foe_y)) if confidence > self.confidence_threshold else None
+        foe = (int(foe_x * stride), int(foe_y * stride)) if confidence > self.confidence_threshold else None
         
         return foe, confidence
     
-    def _least_squares_foe(self, flow_x, flow_y, magnitude, mask, w, h):
+    def _least_squares_foe(self, flow_x, flow_y, valid_mag, mask, w, h, stride=1):
         """
         Estimate FOE using least squares intersection of flow lines.
         
         Each flow vector defines a line: p + t*v
         FOE is at intersection of all lines (minimize perpendicular distance).
         """
-        # Create coordinate grids
-        yy, xx = np.mgrid[0:h, 0:w]
+        # Coordinates of valid flow vectors only (no full HxW grid)
+        valid_y, valid_x = np.nonzero(mask)
+        valid_x = valid_x.astype(np.float32)
+        valid_y = valid_y.astype(np.float32)
         
         # Get valid flow vectors
-        valid_x = xx[mask].astype(np.float32)
-        valid_y = yy[mask].astype(np.float32)
         valid_flow_x = flow_x[mask]
         valid_flow_y = flow_y[mask]
-        valid_mag = magnitude[mask]
         
         # Normalize directions
         dx = valid_flow_x / (valid_mag + 1e-6)
@@ -156,12 +204,13 @@ class FOEDetector:
         A = np.stack([dx, -dy], axis=1)
         b = dx * valid_y - dy * valid_x
         
-        # Weight by magnitude
-        W = np.diag(valid_mag / (np.sum(valid_mag) + 1e-6))
+        # Weight by magnitude (row-scale A instead of building the NxN diag(w))
+        w_mag = valid_mag / (np.sum(valid_mag) + 1e-6)
+        Aw = A * w_mag[:, None]
         
         # Solve: A^T W A foe = A^T W b
-        AtWA = A.T @ W @ A
-        AtWb = A.T @ W @ b
+        AtWA = A.T @ Aw
+        AtWb = Aw.T @ b
         
         try:
             foe_xy = np.linalg.solve(AtWA, AtWb)
@@ -178,15 +227,20 @@ class FOEDetector:
         confidence = max(0.0, 1.0 - mean_residual / max_expected_residual)
         
         # Check bounds
-        margin = 0.3
-        if (foe_x < -w*margin or foe_x > w*(1+margin) or 
-            foe_y < -h*margin or foe_y > h*(1+margin)):
+        if self._out_of_bounds(foe_x, foe_y, w, h):
             confidence *= 0.5
         
-        foe = (int(foe_x), int(foe_y)) if confidence > self.confidence_threshold else None
+        foe = (int(foe_x * stride), int(foe_y * stride)) if confidence > self.confidence_threshold else None
         
         return foe, confidence
     
+    @staticmethod
+    def _out_of_bounds(foe_x, foe_y, w, h, margin=0.3):
+        """True if FOE lies more than margin (fraction of frame) outside the frame."""
+        # Distance from center vs half-extent: one compare per axis
+        return (abs(foe_x - 0.5 * w) > (0.5 + margin) * w or
+                abs(foe_y - 0.5 * h) > (0.5 + margin) * h)
+    
     def get_heading_offset(self, frame_shape):
         """
         Get heading offset from frame center.
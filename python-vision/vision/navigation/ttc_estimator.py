@@ -12,6 +12,42 @@ Based on:
 
 import numpy as np
 
+from ..utils.jit import njit, prange, NUMBA_AVAILABLE
+
+
+HISTORY_LEN = 10       # Frames of size history kept per region
+INITIAL_REGIONS = 64   # History rows preallocated (grows by doubling)
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _expansion_tau_kernel(divergence_map, flow_magnitude_map, tau_map):
+    """Fused tau ~ 1/divergence over expanding pixels (two passes over HxW)."""
+    h, w = divergence_map.shape
+    
+    # Pass 1: mean flow magnitude over expanding pixels
+    total = 0.0
+    count = 0
+    for i in prange(h):
+        for j in range(w):
+            if divergence_map[i, j] > 0.01:
+                total += flow_magnitude_map[i, j]
+                count += 1
+    
+    scale = 1.0
+    if count > 0:
+        avg_magnitude = total / count
+        if avg_magnitude > 1.0:
+            scale = 10.0 / avg_magnitude
+    
+    # Pass 2: tau where expanding, inf elsewhere
+    for i in prange(h):
+        for j in range(w):
+            d = divergence_map[i, j]
+            if d > 0.01:
+                tau_map[i, j] = scale / (d + 1e-6)
+            else:
+                tau_map[i, j] = np.inf
+
 
 class TauTTCEstimator:
     """Estimate time-to-contact using tau theory."""
@@ -26,7 +62,14 @@ class TauTTCEstimator:
         """
         self.min_size = min_size
         self.min_rate = min_rate
-        self.region_history = {}  # region_id -> [sizes, times]
+        self.region_history = {}  # region_id -> row in the history arrays
+        
+        # Struct-of-arrays history: one row of ring buffers per tracked region
+        self._sizes = np.zeros((INITIAL_REGIONS, HISTORY_LEN), dtype=np.float64)
+        self._times = np.zeros((INITIAL_REGIONS, HISTORY_LEN), dtype=np.float64)
+        self._head = np.zeros(INITIAL_REGIONS, dtype=np.intp)   # Next write slot
+        self._n = np.zeros(INITIAL_REGIONS, dtype=np.int32)     # Valid samples
+        self._free_rows = list(range(INITIAL_REGIONS - 1, -1, -1))
         
     def compute_tau(self, region_id, current_size, current_time):
         """
@@ -49,38 +92,32 @@ class TauTTCEstimator:
             return None, None, None
         
         # Initialize history if new region
-        if region_id not in self.region_history:
-            self.region_history[region_id] = {
-                'sizes': [current_size],
-                'times': [current_time]
-            }
+        row = self.region_history.get(region_id)
+        if row is None:
+            row = self._alloc_row(region_id)
+            self._push(row, current_size, current_time)
             return None, None, None
         
-        history = self.region_history[region_id]
-        
-        # Add current measurement
-        history['sizes'].append(current_size)
-        history['times'].append(current_time)
-        
-        # Keep only recent history (last 10 frames)
-        if len(history['sizes']) > 10:
-            history['sizes'] = history['sizes'][-10:]
-            history['times'] = history['times'][-10:]
+        # Add current measurement (ring buffer keeps the last HISTORY_LEN frames)
+        self._push(row, current_size, current_time)
+        n = self._n[row]
         
         # Need at least 2 measurements
-        if len(history['sizes']) < 2:
+        if n < 2:
             return None, None, None
         
-        # Compute expansion rate using linear regression (more robust)
-        sizes = np.array(history['sizes'])
-        times = np.array(history['times'])
+        sizes = self._sizes[row]
+        times = self._times[row]
+        head = self._head[row]
+        i1 = (head - 1) % HISTORY_LEN
+        i2 = (head - 2) % HISTORY_LEN
         
         # Simple finite difference for recent rate
-        dt = times[-1] - times[-2]
+        dt = times[i1] - times[i2]
         if dt < 1e-6:
             return None, None, None
         
-        expansion_rate = (sizes[-1] - sizes[-2]) / dt
+        expansion_rate = (sizes[i1] - sizes[i2]) / dt
         
         # Check if expansion is significant
         if abs(expansion_rate) < self.min_rate:
@@ -95,10 +132,11 @@ class TauTTCEstimator:
         
         # Compute tau_dot if we have enough history
         tau_dot = None
-        if len(history['sizes']) >= 3:
+        if n >= 3:
             # Previous tau
-            prev_size = sizes[-2]
-            prev_rate = (sizes[-2] - sizes[-3]) / (times[-2] - times[-3])
+            i3 = (head - 3) % HISTORY_LEN
+            prev_size = sizes[i2]
+            prev_rate = (sizes[i2] - sizes[i3]) / (times[i2] - times[i3])
             if abs(prev_rate) >= self.min_rate:
                 prev_tau = prev_size / prev_rate
                 if prev_tau > 0:
@@ -106,6 +144,105 @@ class TauTTCEstimator:
         
         return tau, tau_dot, expansion_rate
     
+    def compute_tau_batch(self, region_ids, sizes, times):
+        """
+        Vectorized compute_tau() for many regions in one call.
+        
+        Args:
+            region_ids: Sequence of K unique region identifiers
+            sizes: Current sizes, shape (K,)
+            times: Current timestamps, shape (K,) or a scalar
+        
+        Returns:
+            tau, tau_dot, expansion_rate: float64 arrays of shape (K,),
+            NaN wherever compute_tau() would return None
+        """
+        sizes = np.asarray(sizes, dtype=np.float64)
+        times = np.broadcast_to(np.asarray(times, dtype=np.float64), sizes.shape)
+        k = sizes.shape[0]
+        
+        tau = np.full(k, np.nan)
+        tau_dot = np.full(k, np.nan)
+        expansion_rate = np.full(k, np.nan)
+        
+        # Size gate for all regions at once; nothing to update if none pass
+        tracked = sizes >= self.min_size
+        if not tracked.any():
+            return tau, tau_dot, expansion_rate
+        
+        # Map ids to rows (only new regions allocate)
+        rows = np.full(k, -1, dtype=np.intp)
+        is_new = np.zeros(k, dtype=bool)
+        for i in np.flatnonzero(tracked):
+            row = self.region_history.get(region_ids[i])
+            if row is None:
+                row = self._alloc_row(region_ids[i])
+                is_new[i] = True
+            rows[i] = row
+        
+        # Append measurements to every tracked row at once
+        r = rows[tracked]
+        head = self._head[r]
+        self._sizes[r, head] = sizes[tracked]
+        self._times[r, head] = times[tracked]
+        self._head[r] = (head + 1) % HISTORY_LEN
+        self._n[r] = np.minimum(self._n[r] + 1, HISTORY_LEN)
+        
+        # Existing regions now have >= 2 samples
+        idx = np.flatnonzero(tracked & ~is_new)
+        if idx.size == 0:
+            return tau, tau_dot, expansion_rate
+        
+        r = rows[idx]
+        head = self._head[r]
+        i1 = (head - 1) % HISTORY_LEN
+        i2 = (head - 2) % HISTORY_LEN
+        i3 = (head - 3) % HISTORY_LEN
+        s1, s2, s3 = self._sizes[r, i1], self._sizes[r, i2], self._sizes[r, i3]
+        t1, t2, t3 = self._times[r, i1], self._times[r, i2], self._times[r, i3]
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dt = t1 - t2
+            rate = (s1 - s2) / dt
+            valid = (dt >= 1e-6) & (np.abs(rate) >= self.min_rate)
+            tau_k = s1 / rate
+            
+            prev_rate = (s2 - s3) / (t2 - t3)
+            prev_tau = s2 / prev_rate
+            tau_dot_k = (tau_k - prev_tau) / dt
+            has_dot = ((self._n[r] >= 3) & (np.abs(prev_rate) >= self.min_rate) &
+                       (prev_tau > 0) & (tau_k >= 0))
+        
+        expansion_rate[idx] = np.where(valid, rate, np.nan)
+        tau[idx] = np.where(valid & (tau_k >= 0), tau_k, np.nan)
+        tau_dot[idx] = np.where(valid & has_dot, tau_dot_k, np.nan)
+        
+        return tau, tau_dot, expansion_rate
+    
+    def _alloc_row(self, region_id):
+        """Assign a history row to a new region, growing the arrays if needed."""
+        if not self._free_rows:
+            capacity = self._n.shape[0]
+            self._sizes = np.concatenate([self._sizes, np.zeros_like(self._sizes)])
+            self._times = np.concatenate([self._times, np.zeros_like(self._times)])
+            self._head = np.concatenate([self._head, np.zeros_like(self._head)])
+            self._n = np.concatenate([self._n, np.zeros_like(self._n)])
+            self._free_rows = list(range(2 * capacity - 1, capacity - 1, -1))
+        
+        row = self._free_rows.pop()
+        self._head[row] = 0
+        self._n[row] = 0
+        self.region_history[region_id] = row
+        return row
+    
+    def _push(self, row, size, timestamp):
+        """Append a measurement to a region's ring buffer."""
+        head = self._head[row]
+        self._sizes[row, head] = size
+        self._times[row, head] = timestamp
+        self._head[row] = (head + 1) % HISTORY_LEN
+        self._n[row] = min(self._n[row] + 1, HISTORY_LEN)
+    
     def compute_tau_simple(self, prev_size, curr_size, dt):
         """
         Simple tau computation without history (for single use).
@@ -179,8 +316,9 @@ class TauTTCEstimator:
     
     def clear_region(self, region_id):
         """Remove region from history."""
-        if region_id in self.region_history:
-            del self.region_history[region_id]
+        row = self.region_history.pop(region_id, None)
+        if row is not None:
+            self._free_rows.append(row)
     
     def clear_old_regions(self, current_time, max_age=2.0):
         """
@@ -190,15 +328,15 @@ class TauTTCEstimator:
             current_time: Current timestamp
             max_age: Maximum age to keep (seconds)
         """
-        to_remove = []
-        for region_id, history in self.region_history.items():
-            if len(history['times']) > 0:
-                age = current_time - history['times'][-1]
-                if age > max_age:
-                    to_remove.append(region_id)
-        
-        for region_id in to_remove:
-            del self.region_history[region_id]
+        if not self.region_history:
+            return
+        
+        region_ids = list(self.region_history)
+        rows = np.fromiter(self.region_history.values(), dtype=np.intp, count=len(region_ids))
+        last_times = self._times[rows, (self._head[rows] - 1) % HISTORY_LEN]
+        
+        for i in np.flatnonzero(current_time - last_times > max_age):
+            self.clear_region(region_ids[i])
     
     def estimate_from_expansion_field(self, divergence_map, flow_magnitude_map, dt):
         """
@@ -214,15 +352,16 @@ class TauTTCEstimator:
         Returns:
             tau_map: 2D array of tau values (inf where not computable)
         """
-        # Avoid division by zero
-        safe_div = divergence_map.copy()
-        safe_div[np.abs(safe_div) < 0.01] = 0.01
+        tau_map = np.empty(divergence_map.shape, dtype=np.float32)
+        
+        if NUMBA_AVAILABLE:
+            _expansion_tau_kernel(divergence_map, flow_magnitude_map, tau_map)
+            return tau_map
         
         # Tau relates to rate of expansion
         # For uniform expansion: div(v) = k, where k is expansion rate
         # tau ≈ 1 / divergence (for normalized flow)
-        
-        tau_map = np.full_like(divergence_map, np.inf, dtype=np.float32)
+        tau_map.fill(np.inf)
         
         # Only compute where divergence is positive (expansion)
         expanding = divergence_map > 0.01
@@ -9,21 +9,81 @@ Works with monocular camera only - no depth sensor needed.
 import cv2
 import numpy as np
 
+from .utils.jit import njit, prange, NUMBA_AVAILABLE
+
+
+# Eager signature: dense flow from DIS/Farneback is C-contiguous float32.
+# Compiled at import and, with cache=True, loaded from __pycache__ on later
+# runs, so the first frame of a flight never pays for JIT compilation.
+_ZONES_KERNEL_SIGNATURE = 'void(float32[:, :, ::1], intp, intp, intp, intp, float64[::1])'
+
+
+@njit(_ZONES_KERNEL_SIGNATURE, parallel=True, fastmath=True, cache=True)
+def _zones_divergence(flow, cols, rows, zone_w, zone_h, out_div):
+    """Per-zone sampled divergence, one zone per thread."""
+    step_y = max(1, zone_h // 5)
+    step_x = max(1, zone_w // 5)
+    center_y = zone_h // 2
+    center_x = zone_w // 2
+    
+    for z in prange(rows * cols):
+        y0 = (z // cols) * zone_h
+        x0 = (z % cols) * zone_w
+        
+        # Outward flow component on the sampling grid (see _calculate_divergence)
+        div = 0.0
+        samples = 0
+        for y in range(0, zone_h, step_y):
+            dy = y - center_y
+            for x in range(0, zone_w, step_x):
+                dx = x - center_x
+                if dx != 0 or dy != 0:
+                    div += (dx * flow[y0 + y, x0 + x, 0] +
+                            dy * flow[y0 + y, x0 + x, 1]) / np.sqrt(dx * dx + dy * dy)
+                    samples += 1
+        out_div[z] = div / samples if samples > 0 else 0.0
+
 
 class ObstacleDetector:
     """Detect obstacles using optical flow analysis."""
     
-    def __init__(self, grid_size=(4, 3)):
+    def __init__(self, grid_size=(4, 3), flow_method='dis', use_opencl=None,
+                 compute_flow_magnitude=True):
         """
         Initialize obstacle detector.
         
         Args:
             grid_size: (cols, rows) - divide frame into grid for zone analysis
+            flow_method: 'dis' (fast Dense Inverse Search) or 'farneback'
+            use_opencl: Run resize + dense flow on cv2.UMat (OpenCL); None = if available
+            compute_flow_magnitude: Fill flow_magnitude / zone avg_magnitude
+                (the autopilot's speed input; costs a full magnitude pass per
+                frame). When False both are reported as None
         """
         self.grid_size = grid_size
-        self.prev_gray = None
-        
-        # Optical flow parameters
+        self.compute_flow_magnitude = compute_flow_magnitude
+        self.prev_gray = None  # Previous frame at flow resolution
+        
+        # Dense flow runs at reduced resolution; zone results are scaled back
+        # to full-resolution pixels so thresholds and overlays are unchanged
+        self.flow_scale = 0.5
+        self._divergence_tables = {}  # (zone_h, zone_w) -> (ux, uy, samples)
+        self._zone_cache = None       # Zone geometry for the current frame size
+        self._buffers = {}            # Per-frame output arrays reused across frames
+        
+        # Dense flow: DIS is several times faster than Farneback and zone
+        # averages don't need Farneback's per-pixel accuracy
+        if flow_method not in ('dis', 'farneback'):
+            raise ValueError(f"Unknown flow method: {flow_method}")
+        self.flow_method = flow_method
+        self.dis = cv2.DISOpticalFlow_create(cv2.DISOPTICAL_FLOW_PRESET_ULTRAFAST)
+        
+        # OpenCL offload: frames become UMats, flow is downloaded for zone analysis
+        self.use_opencl = cv2.ocl.haveOpenCL() and use_opencl is not False
+        if self.use_opencl:
+            cv2.ocl.setUseOpenCL(True)
+        
+        # Farneback parameters (flow_method='farneback')
         self.flow_params = {
             'pyr_scale': 0.5,
             'levels': 3,
@@ -38,23 +98,40 @@ class ObstacleDetector:
         self.expansion_threshold = 2.0  # Pixels/frame - object expanding (approaching)
         self.ttc_warning = 2.0          # Seconds - time to collision warning
         self.ttc_danger = 1.0           # Seconds - immediate danger
+        self.min_zone_flow = 0.05       # Pixels/frame - below this a zone skips divergence
         
         # Zone safety status
         self.zones = None
         self.safe_directions = {'forward': True, 'left': True, 'right': True, 
                                'up': True, 'down': True}
         
-    def analyze_frame(self, frame):
+        # Adaptive frame skip: after a run of CLEAR frames, only every
+        # clear_skip_stride-th frame computes flow (1 disables skipping)
+        self.skip_after_clear = 10
+        self.clear_skip_stride = 2
+        self._skip_stride = 1
+        self._skip_ctr = 0
+        self._clear_frames = 0
+        self._last_result = None
+        
+    @staticmethod
+    def to_gray(frame):
+        """Grayscale conversion; share the result between detectors via analyze_frame(gray=...)."""
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    
+    def analyze_frame(self, frame, gray=None):
         """
         Analyze frame for obstacles using optical flow.
         
         Args:
             frame: BGR image
+            gray: Optional precomputed grayscale of frame (skips the conversion)
             
         Returns:
             dict with: zones, safe_directions, warnings, flow_viz
         """
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if gray is None:
+            gray = self.to_gray(frame)
         h, w = gray.shape
         
         result = {
@@ -62,27 +139,64 @@ class ObstacleDetector:
             'safe_directions': self.safe_directions.copy(),
             'warnings': [],
             'danger_level': 0,  # 0=safe, 1=caution, 2=danger
-            'flow_magnitude': 0.0
+            'flow_magnitude': 0.0 if self.compute_flow_magnitude else None
         }
         
+        if self.use_opencl:
+            gray = cv2.UMat(gray)
+        
+        # Downsample for flow (zone aggregates don't need full resolution)
+        if self.flow_scale != 1.0:
+            gray = cv2.resize(gray, None, fx=self.flow_scale, fy=self.flow_scale,
+                              interpolation=cv2.INTER_AREA)
+        
         # Need previous frame for optical flow
         if self.prev_gray is None:
             self.prev_gray = gray
             return result
         
+        # Skipped frame: keep the flow baseline one frame old, reuse last result
+        if self._skip_stride > 1:
+            self._skip_ctr += 1
+            if self._skip_ctr % self._skip_stride != 0:
+                self.prev_gray = gray
+                return dict(self._last_result)
+        
         # Calculate dense optical flow
-        flow = cv2.calcOpticalFlowFarneback(
-            self.prev_gray, gray, None, **self.flow_params
-        )
+        if self.flow_method == 'dis':
+            flow = self.dis.calc(self.prev_gray, gray, None)
+        else:
+            # Farneback overwrites a matching flow argument (no OPTFLOW_USE_INITIAL_FLOW);
+            # DIS would take it as an initial estimate, so it gets None above
+            flow_out = None if self.use_opencl else self._buffer(
+                'flow', self.prev_gray.shape + (2,), np.float32)
+            flow = cv2.calcOpticalFlowFarneback(
+                self.prev_gray, gray, flow_out, **self.flow_params
+            )
+        if isinstance(flow, cv2.UMat):
+            flow = flow.get()
+        
+        flow_h, flow_w = flow.shape[:2]
+        upscale = w / flow_w
+        
+        # One magnitude pass + summed-area table: every zone mean (and the
+        # frame mean) is then four lookups instead of a pass over its pixels.
+        # Nothing in the danger logic reads magnitudes, so it can be turned off.
+        mag_integral = None
+        if self.compute_flow_magnitude:
+            mag = cv2.magnitude(flow[..., 0], flow[..., 1],
+                                self._buffer('mag', (flow_h, flow_w), np.float32))
+            mag_integral = cv2.integral(mag, self._buffer('mag_integral', (flow_h + 1, flow_w + 1), np.float64),
+                                        cv2.CV_64F)
         
         # Analyze flow in grid zones
-        zones = self._analyze_zones(flow, w, h)
+        zones = self._analyze_zones(flow, mag_integral, flow_w, flow_h, upscale)
         result['zones'] = zones
         
         # Calculate average flow magnitude
-        mag, ang = cv2.cartToPolar(flow[..., 0], flow[..., 1])
-        avg_flow = np.mean(mag)
-        result['flow_magnitude'] = avg_flow
+        if mag_integral is not None:
+            avg_flow = float(mag_integral[-1, -1]) / (flow_w * flow_h) * upscale
+            result['flow_magnitude'] = avg_flow
         
         # Detect expansion (approaching obstacles)
         danger_zones = []
@@ -106,37 +220,116 @@ class ObstacleDetector:
         # Update safe directions
         result['safe_directions'] = self._update_safe_directions(zones)
         
+        self._update_frame_skip(result)
         self.prev_gray = gray
         return result
     
-    def _analyze_zones(self, flow, width, height):
-        """Analyze optical flow in grid zones."""
+    def _buffer(self, name, shape, dtype):
+        """Reusable output array for cv2 calls; reallocated only when the shape changes."""
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != shape:
+            buf = np.empty(shape, dtype=dtype)
+            self._buffers[name] = buf
+        return buf
+    
+    def _update_frame_skip(self, result):
+        """Relax to every clear_skip_stride-th frame while CLEAR; any warning resets."""
+        if result['danger_level'] == 0:
+            self._clear_frames += 1
+            if self._clear_frames >= self.skip_after_clear:
+                self._skip_stride = self.clear_skip_stride
+        else:
+            self._clear_frames = 0
+            self._skip_stride = 1
+            self._skip_ctr = 0
+        self._last_result = result
+    
+    def _analyze_zones(self, flow, mag_integral, width, height, upscale=1.0):
+        """
+        Analyze optical flow in grid zones.
+        
+        Args:
+            flow: Dense flow (height, width, 2) at flow resolution
+            mag_integral: cv2.integral of the flow magnitude, (height+1, width+1),
+                or None to skip avg_magnitude (reported as None)
+            width, height: Flow field size
+            upscale: Full-resolution / flow-resolution ratio; bounds, sizes and
+                flow-derived rates are reported in full-resolution pixels
+        """
         cols, rows = self.grid_size
-        zone_w = width // cols
-        zone_h = height // rows
+        layout = self._zone_layout(width, height, upscale)
+        zone_w, zone_h = layout['zone_w'], layout['zone_h']
         
         zones = []
         
+        # Zone mean magnitudes from the summed-area table, all zones at once
+        if mag_integral is not None:
+            x_lo, y_lo, x_hi, y_hi = layout['corners']
+            zone_mag = (mag_integral[y_hi, x_hi] - mag_integral[y_lo, x_hi] -
+                        mag_integral[y_hi, x_lo] + mag_integral[y_lo, x_lo]) / max(zone_w * zone_h, 1)
+        else:
+            zone_mag = np.zeros(rows * cols)
+        
+        # All zones in one compiled pass when Numba is available
+        if NUMBA_AVAILABLE:
+            zone_div = np.empty(rows * cols)
+            _zones_divergence(flow, cols, rows, zone_w, zone_h, zone_div)
+        
         for row in range(rows):
             for col in range(cols):
-                # Extract zone
-                x1, x2 = col * zone_w, (col + 1) * zone_w
-                y1, y2 = row * zone_h, (row + 1) * zone_h
-                zone_flow = flow[y1:y2, x1:x2]
+                z = row * cols + col
+                avg_mag = float(zone_mag[z])
                 
-                # Analyze flow in this zone
-                fx = zone_flow[..., 0]
-                fy = zone_flow[..., 1]
+                if NUMBA_AVAILABLE:
+                    div = zone_div[z]
+                elif mag_integral is not None and avg_mag * upscale < self.min_zone_flow:
+                    div = 0.0  # Quick reject: no flow to diverge
+                else:
+                    # Extract zone
+                    x1, y1, x2, y2 = layout['slices'][z]
+                    zone_flow = flow[y1:y2, x1:x2]
+                    
+                    # Calculate divergence (simplified)
+                    # Positive divergence = expansion = approaching obstacle
+                    div = self._calculate_divergence(zone_flow[..., 0], zone_flow[..., 1])
                 
-                mag, ang = cv2.cartToPolar(fx, fy)
-                avg_mag = np.mean(mag)
+                avg_mag *= upscale
+                div *= upscale
                 
-                # Detect expansion pattern (diverging flow = approaching)
-                center_x, center_y = (x1 + x2) // 2, (y1 + y2) // 2
+                zone_info = {
+                    'row': row,
+                    'col': col,
+                    'position': layout['positions'][z],
+                    'bounds': layout['bounds'][z],
+                    'avg_magnitude': avg_mag if mag_integral is not None else None,
+                    'divergence': div,
+                    'expanding': div > 0.5,  # Positive divergence threshold
+                    'expansion_rate': div if div > 0 else 0,
+                    'avg_size': layout['avg_size']
+                }
                 
-                # Calculate divergence (simplified)
-                # Positive divergence = expansion = approaching obstacle
-                div = self._calculate_divergence(fx, fy)
+                zones.append(zone_info)
+        
+        return zones
+    
+    def _zone_layout(self, width, height, upscale):
+        """Zone geometry and labels, built once per (width, height, upscale)."""
+        key = (width, height, upscale)
+        if self._zone_cache is not None and self._zone_cache['key'] == key:
+            return self._zone_cache
+        
+        cols, rows = self.grid_size
+        zone_w = width // cols
+        zone_h = height // rows
+        
+        slices, bounds, positions = [], [], []
+        for row in range(rows):
+            for col in range(cols):
+                x1, x2 = col * zone_w, (col + 1) * zone_w
+                y1, y2 = row * zone_h, (row + 1) * zone_h
+                slices.append((x1, y1, x2, y2))
+                bounds.append((int(x1 * upscale), int(y1 * upscale),
+                               int(x2 * upscale), int(y2 * upscale)))
                 
                 # Zone position label
                 if row == 0:
@@ -153,23 +346,19 @@ class ObstacleDetector:
                 else:
                     h_pos = "center"
                 
-                position = f"{v_pos}-{h_pos}"
-                
-                zone_info = {
-                    'row': row,
-                    'col': col,
-                    'position': position,
-                    'bounds': (x1, y1, x2, y2),
-                    'avg_magnitude': avg_mag,
-                    'divergence': div,
-                    'expanding': div > 0.5,  # Positive divergence threshold
-                    'expansion_rate': div if div > 0 else 0,
-                    'avg_size': min(zone_w, zone_h)
-                }
-                
-                zones.append(zone_info)
-        
-        return zones
+                positions.append(f"{v_pos}-{h_pos}")
+        
+        self._zone_cache = {
+            'key': key,
+            'zone_w': zone_w,
+            'zone_h': zone_h,
+            'slices': slices,        # Flow-resolution (x1, y1, x2, y2)
+            'corners': tuple(np.array(c) for c in zip(*slices)),  # Integral-table indices
+            'bounds': bounds,        # Full-resolution (x1, y1, x2, y2)
+            'positions': positions,
+            'avg_size': min(zone_w, zone_h) * upscale
+        }
+        return self._zone_cache
     
     def _calculate_divergence(self, fx, fy):
         """Calculate divergence of flow field (simplified)."""
@@ -177,67 +366,49 @@ class ObstacleDetector:
         # Simplified: just check if flow is outward from center
         
         h, w = fx.shape
-        center_x, center_y = w // 2, h // 2
-        
-        # Sample points around center
-        divergence = 0
-        samples = 0
-        
-        for y in range(0, h, max(1, h // 5)):
-            for x in range(0, w, max(1, w // 5)):
-                # Vector from center to point
-                dx = x - center_x
-                dy = y - center_y
-                
-                # Flow at this point
-                flow_x = fx[y, x]
-                flow_y = fy[y, x]
-                
-                # Dot product: positive if flow is away from center (expansion)
-                if dx != 0 or dy != 0:
-                    norm = np.sqrt(dx*dx + dy*dy)
-                    dot = (dx * flow_x + dy * flow_y) / norm
-                    divergence += dot
-                    samples += 1
-        
-        return divergence / max(1, samples) if samples > 0 else 0
+        step_y, step_x = max(1, h // 5), max(1, w // 5)
+        
+        # Unit vectors from center to each sample point (zero at the center)
+        table = self._divergence_tables.get((h, w))
+        if table is None:
+            table = self._build_divergence_table(h, w, step_y, step_x)
+            self._divergence_tables[(h, w)] = table
+        ux, uy, samples = table
+        
+        if samples == 0:
+            return 0
+        
+        # Sample points around center; dot product is positive if flow points
+        # away from center (expansion)
+        divergence = (np.einsum('ij,ij->', ux, fx[::step_y, ::step_x]) +
+                      np.einsum('ij,ij->', uy, fy[::step_y, ::step_x]))
+        return float(divergence) / samples
+    
+    @staticmethod
+    def _build_divergence_table(h, w, step_y, step_x):
+        """Center-to-sample unit vectors for a zone of shape (h, w), float32 like the flow."""
+        dy = (np.arange(0, h, step_y) - h // 2).astype(np.float32)[:, None]
+        dx = (np.arange(0, w, step_x) - w // 2).astype(np.float32)[None, :]
+        norm = np.sqrt(dx * dx + dy * dy)
+        nonzero = norm > 0
+        inv_norm = np.divide(np.float32(1.0), norm, out=np.zeros_like(norm), where=nonzero)
+        return dx * inv_norm, dy * inv_norm, int(np.count_nonzero(nonzero))
     
     def _update_safe_directions(self, zones):
         """Determine which directions are safe based on zone analysis."""
-        safe = {
-            'forward': True,
-            'left': True,
-            'right': True,
-            'up': True,
-            'down': True
-        }
-        
-        # Map zones to directions
         cols, rows = self.grid_size
         
-        for zone in zones:
-            if zone['expanding'] and zone['expansion_rate'] > self.expansion_threshold:
-                row, col = zone['row'], zone['col']
-                
-                # Top zones = up direction
-                if row == 0:
-                    safe['up'] = False
-                
-                # Bottom zones = down direction
-                if row == rows - 1:
-                    safe['down'] = False
-                
-                # Left zones
-                if col == 0:
-                    safe['left'] = False
-                
-                # Right zones
-                if col == cols - 1:
-                    safe['right'] = False
-                
-                # Center zones = forward
-                if col == cols // 2 and row == rows // 2:
-                    safe['forward'] = False
+        # (rows, cols) mask of approaching zones; each direction is one edge of it
+        danger = np.array([zone['expanding'] and zone['expansion_rate'] > self.expansion_threshold
+                           for zone in zones], dtype=bool).reshape(rows, cols)
+        
+        safe = {
+            'forward': not danger[rows // 2, cols // 2],  # Center zone
+            'left': not danger[:, 0].any(),
+            'right': not danger[:, -1].any(),
+            'up': not danger[0].any(),                    # Top zones
+            'down': not danger[-1].any()                  # Bottom zones
+        }
         
         return safe
     
@@ -16,20 +16,59 @@ import time
 from .navigation.flow_balancer import FlowBalancer
 
 
+# Zone status codes, ordered by severity
+ZONE_CLEAR, ZONE_CAUTION, ZONE_WARNING, ZONE_DANGER = range(4)
+ZONE_STATUS_NAMES = ('clear', 'caution', 'warning', 'danger')
+
+# Per-zone results as one structured array (one record per zone, row-major)
+ZONE_DTYPE = np.dtype([
+    ('row', 'i4'), ('col', 'i4'),
+    ('x1', 'i4'), ('y1', 'i4'), ('x2', 'i4'), ('y2', 'i4'),
+    ('expansion', 'f4'),
+    ('ttc', 'f4'),
+    ('status', 'u1'),
+    ('num_points', 'i4')
+])
+
+# Overlay (color, thickness) per status code
+_ZONE_STYLES = (
+    ((0, 255, 0), 1),    # Clear: green
+    ((0, 255, 255), 2),  # Caution: yellow
+    ((0, 165, 255), 2),  # Warning: orange
+    ((0, 0, 255), 3)     # Danger: red
+)
+
+
+def zones_to_dicts(zones):
+    """List-of-dicts view of a ZONE_DTYPE array (row, col, bounds, expansion, ttc, status, num_points)."""
+    return [{
+        'row': int(z['row']),
+        'col': int(z['col']),
+        'bounds': (int(z['x1']), int(z['y1']), int(z['x2']), int(z['y2'])),
+        'expansion': float(z['expansion']),
+        'ttc': float(z['ttc']),
+        'status': ZONE_STATUS_NAMES[z['status']],
+        'num_points': int(z['num_points'])
+    } for z in zones]
+
+
 class FastObstacleDetector:
     """Fast obstacle detection using sparse optical flow."""
     
-    def __init__(self, grid_size=(4, 3)):
+    def __init__(self, grid_size=(4, 3), detect_scale=0.5):
         """
         Initialize obstacle detector.
         
         Args:
             grid_size: (cols, rows) - divide frame into grid for zone analysis
+            detect_scale: Resize factor for feature detection only; tracking
+                and all results stay in full-resolution pixels
         """
         self.grid_size = grid_size
         self.prev_gray = None
         self.prev_points = None
         self.last_time = time.time()
+        self._zone_cache = None  # Zone geometry for the current frame size
         
         # Lucas-Kanade parameters (much faster than Farneback)
         self.lk_params = dict(
@@ -46,6 +85,15 @@ class FastObstacleDetector:
             blockSize=7
         )
         
+        # Zones with fewer tracked points get new features on re-detection
+        self.min_zone_points = 4
+        self._redetect_mask = None
+        
+        # Shi-Tomasi cost grows with pixel count: detect corners on a downscaled
+        # frame, then map them back for full-resolution tracking
+        self.detect_scale = detect_scale
+        self._detect_buf = None
+        
         # Danger thresholds
         self.expansion_threshold = 1.5
         self.ttc_warning = 2.0
@@ -54,28 +102,47 @@ class FastObstacleDetector:
         # Flow balancing for navigation
         self.flow_balancer = FlowBalancer(balance_threshold=0.3, speed_target=5.0)
         
-    def analyze_frame(self, frame):
+        # Adaptive frame skip: after a run of CLEAR frames, only every
+        # clear_skip_stride-th frame tracks points (1 disables skipping)
+        self.skip_after_clear = 10
+        self.clear_skip_stride = 2
+        self._skip_stride = 1
+        self._skip_ctr = 0
+        self._clear_frames = 0
+        self._frames_since_flow = 1
+        self._last_result = None
+        
+    @staticmethod
+    def to_gray(frame):
+        """Grayscale conversion; share the result between detectors via analyze_frame(gray=...)."""
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    
+    def analyze_frame(self, frame, gray=None):
         """
         Analyze frame for obstacles using sparse optical flow.
         
         Args:
             frame: BGR image
+            gray: Optional precomputed grayscale of frame (skips the conversion)
             
         Returns:
-            dict with: zones, safe_directions, warnings, flow_magnitude, points, foe, heading
+            dict with: zones (ZONE_DTYPE array), safe_directions, warnings, flow_magnitude,
+            points_new, points_old, balance
         """
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if gray is None:
+            gray = self.to_gray(frame)
         h, w = gray.shape
         current_time = time.time()
         dt = current_time - self.last_time
         
         result = {
-            'zones': [],
+            'zones': np.zeros(0, dtype=ZONE_DTYPE),
             'safe_directions': {'forward': True, 'left': True, 'right': True, 'up': True, 'down': True},
             'warnings': [],
             'danger_level': 0,
             'flow_magnitude': 0.0,
-            'points': [],
+            'points_new': np.empty((0, 2), dtype=np.float32),  # Tracked positions (N, 2)
+            'points_old': np.empty((0, 2), dtype=np.float32),  # Previous positions (N, 2)
             'balance': None,
             'dt': dt
         }
@@ -83,9 +150,16 @@ class FastObstacleDetector:
         if self.prev_gray is None:
             self.prev_gray = gray
             # Detect initial features
-            self.prev_points = cv2.goodFeaturesToTrack(gray, mask=None, **self.feature_params)
+            self.prev_points = self._good_features(gray)
             return result
         
+        # Skipped frame: points are tracked across the gap next time, reuse last result
+        if self._skip_stride > 1:
+            self._skip_ctr += 1
+            if self._skip_ctr % self._skip_stride != 0:
+                self._frames_since_flow += 1
+                return dict(self._last_result)
+        
         # Calculate sparse optical flow
         if self.prev_points is not None and len(self.prev_points) > 0:
             next_points, status, err = cv2.calcOpticalFlowPyrLK(
@@ -98,15 +172,18 @@ class FastObstacleDetector:
                 good_old = self.prev_points[status == 1]
                 
                 if len(good_new) > 0:
-                    # Calculate flow vectors
+                    # Calculate flow vectors (per frame, even across skipped frames)
                     flow_vectors = good_new - good_old
+                    if self._frames_since_flow > 1:
+                        flow_vectors /= self._frames_since_flow
                     
                     # Calculate flow magnitude
-                    magnitudes = np.linalg.norm(flow_vectors, axis=1)
+                    magnitudes = np.hypot(flow_vectors[:, 0], flow_vectors[:, 1])
                     result['flow_magnitude'] = float(np.mean(magnitudes))
                     
                     # Store points for visualization
-                    result['points'] = [(new, old) for new, old in zip(good_new, good_old)]
+                    result['points_new'] = good_new
+                    result['points_old'] = good_old
                     
                     # Create magnitude map for flow balancing
                     mag_map = self._create_magnitude_map(good_new, magnitudes, w, h)
@@ -122,13 +199,15 @@ class FastObstacleDetector:
         
         # Re-detect features if too few
         if self.prev_points is None or len(self.prev_points) < 50:
-            self.prev_points = cv2.goodFeaturesToTrack(gray, mask=None, **self.feature_params)
+            self.prev_points = self._redetect_features(gray, result)
         else:
             # Update points for next frame
-            if 'points' in result and len(result['points']) > 0:
-                self.prev_points = np.array([new for new, old in result['points']], dtype=np.float32).reshape(-1, 1, 2)
+            if len(result['points_new']) > 0:
+                self.prev_points = result['points_new'].reshape(-1, 1, 2).astype(np.float32, copy=False)
             else:
-                self.prev_points = cv2.goodFeaturesToTrack(gray, mask=None, **self.feature_params)
+                self.prev_points = self._good_features(gray)
+        
+        self._update_frame_skip(result)
         
         # Update for next frame
         self.prev_gray = gray
@@ -136,6 +215,82 @@ class FastObstacleDetector:
         
         return result
     
+    def _redetect_features(self, gray, result):
+        """
+        Top up tracked points by detecting features only in under-populated zones.
+        
+        Falls back to a full-frame detection when nothing is being tracked yet
+        or no zone is short of points.
+        """
+        tracked = result['points_new']
+        zones = result['zones']
+        sparse_zones = zones[zones['num_points'] < self.min_zone_points]
+        if len(tracked) == 0 or len(sparse_zones) == 0:
+            return self._good_features(gray)
+        
+        if self._redetect_mask is None or self._redetect_mask.shape != gray.shape:
+            self._redetect_mask = np.zeros(gray.shape, dtype=np.uint8)
+        mask = self._redetect_mask
+        mask.fill(0)
+        for x1, y1, x2, y2 in zip(sparse_zones['x1'].tolist(), sparse_zones['y1'].tolist(),
+                                  sparse_zones['x2'].tolist(), sparse_zones['y2'].tolist()):
+            mask[y1:y2, x1:x2] = 255
+        
+        # Shi-Tomasi cost scales with the masked area; keep the total under maxCorners
+        new_points = self._good_features(
+            gray, mask, max_corners=max(1, self.feature_params['maxCorners'] - len(tracked))
+        )
+        
+        tracked = tracked.reshape(-1, 1, 2).astype(np.float32, copy=False)
+        if new_points is None:
+            return tracked
+        return np.concatenate([tracked, new_points])
+    
+    def _good_features(self, gray, mask=None, max_corners=None):
+        """
+        Shi-Tomasi corners detected at detect_scale.
+        
+        Returns:
+            (N, 1, 2) float32 corners in full-resolution pixels, or None
+        """
+        params = self.feature_params
+        if max_corners is not None:
+            params = dict(params, maxCorners=max_corners)
+        
+        scale = self.detect_scale
+        if scale == 1.0:
+            return cv2.goodFeaturesToTrack(gray, mask=mask, **params)
+        
+        h, w = gray.shape
+        size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+        if self._detect_buf is None or self._detect_buf.shape != (size[1], size[0]):
+            self._detect_buf = np.empty((size[1], size[0]), dtype=np.uint8)
+        small = cv2.resize(gray, size, dst=self._detect_buf, interpolation=cv2.INTER_AREA)
+        if mask is not None:
+            mask = cv2.resize(mask, size, interpolation=cv2.INTER_NEAREST)
+        
+        corners = cv2.goodFeaturesToTrack(small, mask=mask,
+                                          **dict(params, minDistance=params['minDistance'] * scale))
+        if corners is not None:
+            # Pixel centers: small pixel i covers full-res [i/scale, (i+1)/scale)
+            corners += 0.5
+            corners *= 1.0 / scale
+            corners -= 0.5
+        return corners
+    
+    def _update_frame_skip(self, result):
+        """Relax to every clear_skip_stride-th frame while CLEAR; any warning resets."""
+        if result['danger_level'] == 0:
+            self._clear_frames += 1
+            if self._clear_frames >= self.skip_after_clear:
+                self._skip_stride = self.clear_skip_stride
+        else:
+            self._clear_frames = 0
+            self._skip_stride = 1
+            self._skip_ctr = 0
+        self._frames_since_flow = 1
+        self._last_result = result
+    
     def _create_magnitude_map(self, points, magnitudes, width, height):
         """
         Create a simple magnitude map from sparse flow points.
@@ -164,153 +319,165 @@ class FastObstacleDetector:
     def _analyze_zones_sparse(self, new_points, old_points, flow_vectors, width, height, dt):
         """Analyze zones using sparse flow vectors."""
         cols, rows = self.grid_size
-        zone_width = width / cols
-        zone_height = height / rows
+        n_zones = rows * cols
+        layout = self._zone_layout(width, height)
+        x_edges, y_edges = layout['x_edges'], layout['y_edges']
+        
+        # Assign every point to its zone once (points outside the frame get none)
+        col_idx = np.searchsorted(x_edges, new_points[:, 0], side='right') - 1
+        row_idx = np.searchsorted(y_edges, new_points[:, 1], side='right') - 1
+        inside = (col_idx >= 0) & (col_idx < cols) & (row_idx >= 0) & (row_idx < rows)
+        zone_idx = row_idx[inside] * cols + col_idx[inside]
+        points = new_points[inside]
+        flows = flow_vectors[inside]
+        
+        # Vectors from each point to its zone center
+        to_center_x = layout['centers_x'][zone_idx % cols] - points[:, 0]
+        to_center_y = layout['centers_y'][zone_idx // cols] - points[:, 1]
+        
+        # Normalize
+        distances = np.sqrt(to_center_x * to_center_x + to_center_y * to_center_y)
+        distances[distances < 1] = 1  # Avoid division by zero
+        
+        # Dot product: positive = expanding (approaching)
+        divergence = (flows[:, 0] * to_center_x + flows[:, 1] * to_center_y) / distances
+        
+        # Per-zone sums in one pass each
+        counts = np.bincount(zone_idx, minlength=n_zones)
+        safe_counts = np.maximum(counts, 1)
+        expansions = np.bincount(zone_idx, weights=divergence, minlength=n_zones) / safe_counts
+        avg_distances = np.bincount(zone_idx, weights=distances, minlength=n_zones) / safe_counts
+        
+        # Fresh array per frame (results may be read after the next frame starts);
+        # geometry comes prefilled from the layout template
+        zones = layout['zones'].copy()
+        zones['num_points'] = counts
+        
+        # Need more than 3 points for a zone estimate
+        expansion = np.where(counts > 3, expansions, 0.0)
+        zones['expansion'] = expansion
+        
+        # Simple TTC estimation
+        approaching = expansion > 0.5
+        ttc = np.full(n_zones, np.inf)
+        ttc[approaching] = avg_distances[approaching] / (expansion[approaching] * 30)  # 30 fps assumption
+        zones['ttc'] = ttc
+        
+        zones['status'] = np.select(
+            [ttc < self.ttc_danger, ttc < self.ttc_warning,
+             approaching & (expansion > self.expansion_threshold)],
+            [ZONE_DANGER, ZONE_WARNING, ZONE_CAUTION],
+            default=ZONE_CLEAR
+        )
         
-        zones = []
+        return zones
+    
+    def _zone_layout(self, width, height):
+        """Zone edges, centers and bounds, built once per frame size."""
+        if self._zone_cache is not None and self._zone_cache['size'] == (width, height):
+            return self._zone_cache
         
-        for row in range(rows):
-            for col in range(cols):
-                # Define zone boundaries
-                x1 = int(col * zone_width)
-                y1 = int(row * zone_height)
-                x2 = int((col + 1) * zone_width)
-                y2 = int((row + 1) * zone_height)
-                
-                # Find points in this zone
-                zone_mask = (
-                    (new_points[:, 0] >= x1) & (new_points[:, 0] < x2) &
-                    (new_points[:, 1] >= y1) & (new_points[:, 1] < y2)
-                )
-                
-                zone_flows = flow_vectors[zone_mask]
-                
-                zone_data = {
-                    'row': row,
-                    'col': col,
-                    'bounds': (x1, y1, x2, y2),
-                    'expansion': 0.0,
-                    'ttc': float('inf'),
-                    'status': 'clear',
-                    'num_points': int(np.sum(zone_mask))
-                }
-                
-                if len(zone_flows) > 3:  # Need at least 3 points
-                    # Calculate divergence (expansion)
-                    zone_points = new_points[zone_mask]
-                    zone_center_x = (x1 + x2) / 2
-                    zone_center_y = (y1 + y2) / 2
-                    
-                    # Vectors from center to points
-                    to_center = np.array([zone_center_x - zone_points[:, 0],
-                                         zone_center_y - zone_points[:, 1]]).T
-                    
-                    # Normalize
-                    distances = np.linalg.norm(to_center, axis=1, keepdims=True)
-                    distances[distances < 1] = 1  # Avoid division by zero
-                    to_center_norm = to_center / distances
-                    
-                    # Dot product: positive = expanding (approaching)
-                    divergence = np.sum(zone_flows * to_center_norm, axis=1)
-                    expansion = float(np.mean(divergence))
-                    
-                    zone_data['expansion'] = expansion
-                    
-                    # Simple TTC estimation
-                    if expansion > 0.5:
-                        avg_distance = float(np.mean(distances))
-                        ttc = avg_distance / (expansion * 30)  # 30 fps assumption
-                        zone_data['ttc'] = ttc
-                        
-                        if ttc < self.ttc_danger:
-                            zone_data['status'] = 'danger'
-                        elif ttc < self.ttc_warning:
-                            zone_data['status'] = 'warning'
-                        elif expansion > self.expansion_threshold:
-                            zone_data['status'] = 'caution'
-                
-                zones.append(zone_data)
+        cols, rows = self.grid_size
+        zone_width = width / cols
+        zone_height = height / rows
         
-        return zones
+        # Zone boundaries (same integer edges as the drawn grid)
+        x_edges = np.array([int(c * zone_width) for c in range(cols + 1)])
+        y_edges = np.array([int(r * zone_height) for r in range(rows + 1)])
+        
+        zones = np.zeros(rows * cols, dtype=ZONE_DTYPE)
+        zones['row'] = np.repeat(np.arange(rows), cols)
+        zones['col'] = np.tile(np.arange(cols), rows)
+        zones['x1'] = x_edges[zones['col']]
+        zones['y1'] = y_edges[zones['row']]
+        zones['x2'] = x_edges[zones['col'] + 1]
+        zones['y2'] = y_edges[zones['row'] + 1]
+        zones['ttc'] = np.inf
+        
+        self._zone_cache = {
+            'size': (width, height),
+            'x_edges': x_edges,
+            'y_edges': y_edges,
+            # float32 so point arithmetic stays in the tracker's precision
+            'centers_x': ((x_edges[:-1] + x_edges[1:]) / 2).astype(np.float32),
+            'centers_y': ((y_edges[:-1] + y_edges[1:]) / 2).astype(np.float32),
+            'zones': zones  # ZONE_DTYPE template with geometry filled in
+        }
+        return self._zone_cache
     
     def _update_safe_directions(self, result):
         """Update safe flight directions based on zone analysis."""
         cols, rows = self.grid_size
         
-        # Reset all to safe
-        result['safe_directions'] = {'forward': True, 'left': True, 'right': True, 
-                                    'up': True, 'down': True}
-        result['warnings'] = []
-        result['danger_level'] = 0
+        zones = result['zones']
+        status = zones['status']
         
-        for zone in result['zones']:
-            if zone['status'] in ['warning', 'danger']:
-                row, col = zone['row'], zone['col']
-                
-                # Map zones to directions
-                # Top rows = up, bottom rows = down
-                if row == 0:
-                    result['safe_directions']['up'] = False
-                elif row == rows - 1:
-                    result['safe_directions']['down'] = False
-                
-                # Left cols = left, right cols = right
-                if col == 0:
-                    result['safe_directions']['left'] = False
-                elif col == cols - 1:
-                    result['safe_directions']['right'] = False
-                
-                # Center zones = forward
-                if col in range(1, cols - 1) and row in range(1, rows - 1):
-                    result['safe_directions']['forward'] = False
-                
-                # Add warning
-                if zone['status'] == 'danger':
-                    result['danger_level'] = max(result['danger_level'], 3)
-                    result['warnings'].append(f"DANGER: Zone [{row},{col}] TTC={zone['ttc']:.1f}s")
-                else:
-                    result['danger_level'] = max(result['danger_level'], 2)
-                    result['warnings'].append(f"WARNING: Zone [{row},{col}] approaching")
+        # (rows, cols) mask of warning/danger zones; each direction is one edge of it
+        flagged = (status >= ZONE_WARNING).reshape(rows, cols)
+        
+        # Top rows = up, bottom rows = down, edge columns = left/right,
+        # interior zones = forward (a single row/column only counts as up/left)
+        result['safe_directions'] = {
+            'forward': not flagged[1:-1, 1:-1].any(),
+            'left': not flagged[:, 0].any(),
+            'right': not (cols > 1 and flagged[:, -1].any()),
+            'up': not flagged[0].any(),
+            'down': not (rows > 1 and flagged[-1].any())
+        }
+        result['danger_level'] = int(status.max(initial=ZONE_CLEAR)) if flagged.any() else 0
+        
+        # Add warnings
+        result['warnings'] = []
+        for z in np.flatnonzero(status >= ZONE_WARNING).tolist():
+            row, col = int(zones['row'][z]), int(zones['col'][z])
+            if status[z] == ZONE_DANGER:
+                result['warnings'].append(f"DANGER: Zone [{row},{col}] TTC={zones['ttc'][z]:.1f}s")
+            else:
+                result['warnings'].append(f"WARNING: Zone [{row},{col}] approaching")
     
-    def draw_overlay(self, frame, result):
-        """Draw obstacle detection overlay."""
-        output = frame.copy()
+    def draw_overlay(self, frame, result, dst=None):
+        """
+        Draw obstacle detection overlay.
+        
+        Args:
+            frame: BGR image
+            result: Result from analyze_frame()
+            dst: Optional output image (same shape as frame; may be frame itself
+                to draw in place). None allocates a copy.
+        
+        Returns:
+            Image with the overlay drawn
+        """
+        if dst is None:
+            output = frame.copy()
+        else:
+            output = dst
+            if output is not frame:
+                np.copyto(output, frame)
         
         # Draw flow vectors (sparse points)
-        if 'points' in result:
-            for new, old in result['points']:
-                a, b = new.ravel()
-                c, d = old.ravel()
-                a, b, c, d = int(a), int(b), int(c), int(d)
-                
+        if 'points_new' in result:
+            points_new = result['points_new'].astype(np.int32).tolist()
+            points_old = result['points_old'].astype(np.int32).tolist()
+            for (a, b), (c, d) in zip(points_new, points_old):
                 # Draw line showing motion
                 cv2.line(output, (c, d), (a, b), (0, 255, 0), 1)
                 # Draw current point
                 cv2.circle(output, (a, b), 3, (0, 255, 0), -1)
         
         # Draw zone grid
-        for zone in result['zones']:
-            x1, y1, x2, y2 = zone['bounds']
-            
+        zones = result['zones']
+        for x1, y1, x2, y2, status, num_points in zip(
+                zones['x1'].tolist(), zones['y1'].tolist(), zones['x2'].tolist(),
+                zones['y2'].tolist(), zones['status'].tolist(), zones['num_points'].tolist()):
             # Color based on status
-            if zone['status'] == 'danger':
-                color = (0, 0, 255)  # Red
-                thickness = 3
-            elif zone['status'] == 'warning':
-                color = (0, 165, 255)  # Orange
-                thickness = 2
-            elif zone['status'] == 'caution':
-                color = (0, 255, 255)  # Yellow
-                thickness = 2
-            else:
-                color = (0, 255, 0)  # Green
-                thickness = 1
+            color, thickness = _ZONE_STYLES[status]
             
             cv2.rectangle(output, (x1, y1), (x2, y2), color, thickness)
             
             # Draw point count
-            if zone['num_points'] > 0:
-                text = f"{zone['num_points']}"
+            if num_points > 0:
+                text = f"{num_points}"
                 cv2.putText(output, text, (x1 + 5, y1 + 20),
                            cv2.FONT_HERSHEY_SIMPLEX, 0.4, color, 1)
         
@@ -16,9 +16,65 @@ import av
 import numpy as np
 import cv2
 import argparse
+import concurrent.futures
+import queue
+import sys
+import threading
 import time
-from collections import deque
 from typing import Optional, Tuple
+from av.video.reformatter import VideoReformatter
+
+try:
+    from av.codec.hwaccel import HWAccel, hwdevices_available  # PyAV >= 14
+except ImportError:
+    HWAccel = None
+
+# H.264 NAL unit types (lowest 5 bits of the NAL header byte)
+NAL_IDR = 5
+NAL_SPS = 7
+NAL_PPS = 8
+
+
+def create_hwaccel():
+    """Pick the platform's hardware H.264 decoder (VideoToolbox/CUDA/VAAPI), or None."""
+    if HWAccel is None:
+        return None
+    available = hwdevices_available()
+    candidates = ('videotoolbox',) if sys.platform == 'darwin' else ('cuda', 'vaapi')
+    for device_type in candidates:
+        if device_type in available:
+            return HWAccel(device_type=device_type, allow_software_fallback=True)
+    return None
+
+
+def create_codec(hwaccel=None):
+    """
+    Create an H.264 decoder, falling back to software if hwaccel can't start.
+    
+    Args:
+        hwaccel: HWAccel from create_hwaccel(), or None for software decoding
+    
+    Returns:
+        (codec, hwaccel) - hwaccel is None when the software decoder is used
+    """
+    if hwaccel is not None:
+        try:
+            codec = av.CodecContext.create('h264', 'r', hwaccel=hwaccel)
+            print("✓ Hardware decoding enabled")
+            return codec, hwaccel
+        except av.FFmpegError as e:
+            print(f"⚠ Hardware decoding unavailable ({e}), using software")
+    return av.CodecContext.create('h264', 'r'), None
+
+
+def luma_plane(frame) -> np.ndarray:
+    """Grayscale image straight from the Y plane of a YUV/NV12 frame."""
+    if frame.format.name.startswith(('yuv', 'nv')):
+        plane = frame.planes[0]
+        luma = np.frombuffer(plane, dtype=np.uint8).reshape(-1, plane.line_size)
+        # Copy once: the decoder reuses the frame's buffer
+        return luma[:frame.height, :frame.width].copy()
+    return frame.to_ndarray(format='gray')
 
 
 class H264StreamDecoder:
@@ -26,26 +82,34 @@ class H264StreamDecoder:
     
     def __init__(self, websocket_url: str = "ws://localhost:9000/stream", 
                  output_grayscale: bool = True,
-                 max_buffer_size: int = 30):
+                 hwaccel: bool = True,
+                 max_pending_nals: int = 30):
         """
         Initialize H.264 stream decoder.
         
         Args:
             websocket_url: WebSocket endpoint URL
             output_grayscale: Convert frames to grayscale (for SLAM)
-            max_buffer_size: Maximum frames to buffer
+            hwaccel: Use the hardware H.264 decoder when available
+            max_pending_nals: Backlog size above which queued NAL units before
+                the newest IDR frame are dropped to catch up with realtime
         """
         self.websocket_url = websocket_url
         self.output_grayscale = output_grayscale
-        self.max_buffer_size = max_buffer_size
+        self.max_pending_nals = max_pending_nals
+        self.hwaccel = create_hwaccel() if hwaccel else None
+        self._reformatter = VideoReformatter()  # Reuses one swscale context for all frames
         
         self.websocket = None
         self.codec = None
-        self.frame_buffer = deque(maxlen=max_buffer_size)
+        self._latest_frame = None  # Only the newest frame is ever read; single-ref write is atomic
         self.running = False
         
+        self._decode_pool = None  # Decode worker thread, created in connect()
+        
         # Stats
         self.frame_count = 0
+        self.dropped_nals = 0
         self.last_fps_time = time.time()
         self.fps = 0.0
         
@@ -66,19 +130,33 @@ class H264StreamDecoder:
             self.running = True
             
             # Initialize PyAV H.264 decoder
-            self.codec = av.CodecContext.create('h264', 'r')
-            print("✓ H.264 decoder initialized")
+            self.codec = self._create_codec()
+            
+            # Single decode worker: keeps NAL order and confines codec.decode() to one
+            # thread, while the event loop keeps receiving (PyAV drops the GIL in decode)
+            self._decode_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='h264-decode'
+            )
             
         except Exception as e:
             print(f"✗ Connection failed: {e}")
             raise
     
+    def _create_codec(self):
+        """Create the H.264 decoder (see create_codec)."""
+        codec, self.hwaccel = create_codec(self.hwaccel)
+        print("✓ H.264 decoder initialized")
+        return codec
+    
     async def disconnect(self):
         """Close WebSocket connection."""
         self.running = False
         if self.websocket:
             await self.websocket.close()
             print("Disconnected from video stream")
+        if self._decode_pool:
+            self._decode_pool.shutdown(wait=False)
+            self._decode_pool = None
     
     def _decode_nal_unit(self, nal_data: bytes) -> Optional[np.ndarray]:
         """
@@ -99,16 +177,12 @@ class H264StreamDecoder:
             
             # Return first frame if any
             for frame in frames:
-                # Convert to numpy array
-                img = frame.to_ndarray(format='rgb24')
-                
-                # Convert to grayscale if needed
+                # Grayscale: the Y plane (native in NV12 hw output) is the image
                 if self.output_grayscale:
-                    img = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-                else:
-                    img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+                    return luma_plane(frame)
                 
-                return img
+                # Color: convert straight to BGR (no rgb24 + cvtColor round-trip)
+                return self._reformatter.reformat(frame, format='bgr24').to_ndarray()
                 
         except Exception as e:
             # Decoding errors are common for incomplete frames
@@ -116,6 +190,23 @@ class H264StreamDecoder:
         
         return None
     
+    def _decode_batch(self, nal_units) -> list:
+        """
+        Decode a burst of NAL units in order.
+        
+        Each unit stays its own packet: concatenating access units into one
+        av.Packet makes the decoder drop every frame after the first.
+        
+        Returns:
+            Decoded frames, oldest first
+        """
+        frames = []
+        for nal_data in nal_units:
+            frame = self._decode_nal_unit(nal_data)
+            if frame is not None:
+                frames.append(frame)
+        return frames
+    
     def _update_fps(self):
         """Update FPS calculation."""
         current_time = time.time()
@@ -135,36 +226,111 @@ class H264StreamDecoder:
             raise RuntimeError("Not connected. Call connect() first.")
         
         print("Receiving video stream...")
+        loop = asyncio.get_running_loop()
+        
+        # Socket reads run in their own task so everything that arrived during a
+        # decode can be drained without blocking
+        nal_queue = asyncio.Queue()
+        reader = asyncio.create_task(self._read_messages(nal_queue))
         
         try:
-            async for message in self.websocket:
-                if not self.running:
+            while self.running:
+                message = await nal_queue.get()
+                if message is None:
                     break
                 
-                # Decode NAL unit
-                frame = self._decode_nal_unit(message)
+                # Drain the burst: one decode-thread hop for all queued NAL units
+                nal_units = [message]
+                while True:
+                    try:
+                        message = nal_queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        break
+                    if message is None:
+                        self.running = False
+                        break
+                    nal_units.append(message)
+                
+                # Fell behind: skip to the newest keyframe
+                if len(nal_units) > self.max_pending_nals:
+                    nal_units = self._drop_stale_nals(nal_units)
                 
-                if frame is not None:
+                # Decode NAL units on the decode thread
+                frames = await loop.run_in_executor(self._decode_pool, self._decode_batch, nal_units)
+                
+                for frame in frames:
                     # Update stats
                     self.frame_count += 1
                     self._update_fps()
                     
-                    # Add to buffer
-                    self.frame_buffer.append(frame)
+                    # Publish as the latest frame
+                    self._latest_frame = frame
                     
                     # Yield frame
                     yield frame
                     
+        except Exception as e:
+            print(f"Error receiving frames: {e}")
+        finally:
+            self.running = False
+            reader.cancel()
+    
+    @staticmethod
+    def _nal_types(message: bytes) -> set:
+        """NAL unit types in an Annex-B message (bare NAL units have no start code)."""
+        types = set()
+        start = message.find(b'\x00\x00\x01')
+        if start < 0:
+            if message:
+                types.add(message[0] & 0x1F)
+            return types
+        while start >= 0:
+            header = start + 3
+            if header < len(message):
+                types.add(message[header] & 0x1F)
+            start = message.find(b'\x00\x00\x01', header)
+        return types
+    
+    def _drop_stale_nals(self, nal_units: list) -> list:
+        """
+        Keep only the tail of a backlog that starts at its last IDR frame.
+        
+        P-frames before that IDR can't affect anything after it, so decoding
+        them only adds latency. SPS/PPS are kept so the decoder stays configured.
+        Without an IDR in the backlog nothing can be dropped safely.
+        
+        Args:
+            nal_units: Queued NAL unit messages, oldest first
+            
+        Returns:
+            NAL unit messages to decode, oldest first
+        """
+        nal_types = [self._nal_types(message) for message in nal_units]
+        last_idr = next((i for i in range(len(nal_units) - 1, -1, -1)
+                         if NAL_IDR in nal_types[i]), None)
+        if not last_idr:
+            return nal_units
+        
+        parameter_sets = [message for message, types in zip(nal_units[:last_idr], nal_types)
+                          if types and types <= {NAL_SPS, NAL_PPS}]
+        self.dropped_nals += last_idr - len(parameter_sets)
+        return parameter_sets + nal_units[last_idr:]
+    
+    async def _read_messages(self, nal_queue: asyncio.Queue):
+        """Reader task: queue every WebSocket message, then None when the stream ends."""
+        try:
+            async for message in self.websocket:
+                nal_queue.put_nowait(message)
         except websockets.exceptions.ConnectionClosed:
             print("WebSocket connection closed")
         except Exception as e:
             print(f"Error receiving frames: {e}")
         finally:
-            self.running = False
+            nal_queue.put_nowait(None)
     
     def get_latest_frame(self) -> Optional[np.ndarray]:
-        """Get the most recent frame from buffer."""
-        return self.frame_buffer[-1] if self.frame_buffer else None
+        """Get the most recent decoded frame."""
+        return self._latest_frame
     
     def get_fps(self) -> float:
         """Get current frames per second."""
@@ -181,14 +347,90 @@ class H264StreamDecoder:
         return None
 
 
-async def test_decoder(grayscale: bool = True):
+def _display_loop(frames: queue.Queue, stop: threading.Event, decoder, grayscale: bool):
+    """
+    Show frames from the queue until 'q'/ESC or stop is set (display thread).
+    
+    Args:
+        frames: Size-1 queue of frames to show (None ends the loop)
+        stop: Set here on quit, or by the caller to end the loop
+        decoder: H264StreamDecoder, for the FPS overlay
+        grayscale: Frames are grayscale
+    """
+    cv2.startWindowThread()
+    shown = 0
+    while not stop.is_set():
+        try:
+            frame = frames.get(timeout=0.1)
+        except queue.Empty:
+            cv2.waitKey(1)
+            continue
+        if frame is None:
+            break
+        if not _show_frame(frame, shown, decoder, grayscale):
+            stop.set()
+        shown += 1
+
+
+def _show_frame(frame, shown: int, decoder, grayscale: bool) -> bool:
+    """
+    Draw the FPS overlay, display one frame and handle keys.
+    
+    Returns:
+        False if the user asked to quit
+    """
+    # Overlay FPS on frame
+    fps_text = f"FPS: {decoder.get_fps():.1f} | Press 'q' to quit"
+    cv2.putText(frame, fps_text, (10, 30), 
+               cv2.FONT_HERSHEY_SIMPLEX, 0.7, 
+               255 if grayscale else (0, 255, 0), 2)
+    
+    # Display frame
+    try:
+        cv2.imshow('HS260 Video Stream', frame)
+        if shown == 0:
+            print(f"✓ OpenCV window created")
+            # Try to bring window to front
+            cv2.setWindowProperty('HS260 Video Stream', cv2.WND_PROP_TOPMOST, 1)
+    except Exception as e:
+        print(f"✗ Error displaying frame: {e}")
+        print(f"  OpenCV might not be properly configured for GUI")
+        print(f"  Frames are being received but cannot be displayed")
+    
+    # Handle keyboard (wait 1ms for key press)
+    key = cv2.waitKey(1) & 0xFF
+    if key == ord('q') or key == 27:  # 'q' or ESC
+        print("\nQuitting...")
+        return False
+    elif key == ord('s'):
+        # Save frame
+        filename = f"frame_{int(time.time())}.png"
+        cv2.imwrite(filename, frame)
+        print(f"Saved {filename}")
+    return True
+
+
+async def test_decoder(grayscale: bool = True, hwaccel: bool = True):
     """
     Test the H.264 decoder by displaying the video stream.
     
+    Display runs on its own thread so imshow/waitKey never stall websocket
+    reads; it only ever gets the newest frame. macOS requires GUI calls on
+    the main thread, so there the frames are shown inline.
+    
     Args:
         grayscale: Display in grayscale mode
+        hwaccel: Use the hardware H.264 decoder when available
     """
-    decoder = H264StreamDecoder(output_grayscale=grayscale)
+    decoder = H264StreamDecoder(output_grayscale=grayscale, hwaccel=hwaccel)
+    
+    display_frames = queue.Queue(maxsize=1)
+    stop = threading.Event()
+    display_thread = None
+    if sys.platform != 'darwin':
+        display_thread = threading.Thread(
+            target=_display_loop, args=(display_frames, stop, decoder, grayscale), daemon=True
+        )
     
     try:
         await decoder.connect()
@@ -198,6 +440,9 @@ async def test_decoder(grayscale: bool = True):
         print("Press 's' to save frame")
         print("Press Ctrl+C in terminal to force quit\n")
         
+        if display_thread is not None:
+            display_thread.start()
+        
         frame_count = 0
         async for frame in decoder.receive_frames():
             frame_count += 1
@@ -206,34 +451,18 @@ async def test_decoder(grayscale: bool = True):
                 print(f"✓ First frame received: {frame.shape}")
                 print(f"  Creating OpenCV window...")
             
-            # Overlay FPS on frame
-            fps_text = f"FPS: {decoder.get_fps():.1f} | Press 'q' to quit"
-            cv2.putText(frame, fps_text, (10, 30), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, 
-                       255 if grayscale else (0, 255, 0), 2)
-            
-            # Display frame
-            try:
-                cv2.imshow('HS260 Video Stream', frame)
-                if frame_count == 1:
-                    print(f"✓ OpenCV window created")
-                    # Try to bring window to front
-                    cv2.setWindowProperty('HS260 Video Stream', cv2.WND_PROP_TOPMOST, 1)
-            except Exception as e:
-                print(f"✗ Error displaying frame: {e}")
-                print(f"  OpenCV might not be properly configured for GUI")
-                print(f"  Frames are being received but cannot be displayed")
-            
-            # Handle keyboard (wait 1ms for key press)
-            key = cv2.waitKey(1) & 0xFF
-            if key == ord('q') or key == 27:  # 'q' or ESC
-                print("\nQuitting...")
-                break
-            elif key == ord('s'):
-                # Save frame
-                filename = f"frame_{int(time.time())}.png"
-                cv2.imwrite(filename, frame)
-                print(f"Saved {filename}")
+            if display_thread is None:
+                if not _show_frame(frame, frame_count - 1, decoder, grayscale):
+                    break
+            else:
+                if stop.is_set():
+                    break
+                # Hand over the newest frame; drop the one still waiting, if any
+                try:
+                    display_frames.get_nowait()
+                except queue.Empty:
+                    pass
+                display_frames.put_nowait(frame)
             
             # Print status every 30 frames
             if frame_count % 30 == 0:
@@ -243,6 +472,9 @@ async def test_decoder(grayscale: bool = True):
         print("\n\nInterrupted by user (Ctrl+C)")
     finally:
         await decoder.disconnect()
+        if display_thread is not None and display_thread.is_alive():
+            stop.set()
+            display_thread.join(timeout=1.0)
         cv2.destroyAllWindows()
         
         # Print stats
@@ -260,6 +492,8 @@ def main():
                        help='Run in test mode (display video)')
     parser.add_argument('--color', action='store_true',
                        help='Output color frames instead of grayscale')
+    parser.add_argument('--no-hwaccel', action='store_true',
+                       help='Force software H.264 decoding')
     
     args = parser.parse_args()
     
@@ -271,7 +505,7 @@ def main():
         print("  3. Drone is connected and streaming video")
         print()
         
-        asyncio.run(test_decoder(grayscale=not args.color))
+        asyncio.run(test_decoder(grayscale=not args.color, hwaccel=not args.no_hwaccel))
     else:
         print("Usage: python stream_decoder.py --test")
         print("Or import as module: from vision.stream_decoder import H264StreamDecoder")
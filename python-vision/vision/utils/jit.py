@@ -0,0 +1,45 @@
+"""
+Optional Numba JIT support.
+
+Numeric kernels are decorated with ``njit`` unconditionally; when Numba is
+not installed the decorator is a no-op and the kernels run as plain Python.
+
+Kernels are compiled with ``cache=True``; run ``python -m vision.utils.jit``
+once when deploying (e.g. on the companion computer) to compile them ahead
+of the first flight.
+"""
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """No-op stand-in for numba.njit (supports @njit and @njit(...))."""
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+
+        def decorator(func):
+            return func
+        return decorator
+
+    prange = range
+
+
+__all__ = ['njit', 'prange', 'NUMBA_AVAILABLE']
+
+
+if __name__ == "__main__":
+    import importlib
+    import time
+    
+    if not NUMBA_AVAILABLE:
+        print("⚠ Numba not installed, nothing to compile")
+    else:
+        # Importing a module compiles (or loads cached) its eager-signature kernels
+        for module in ('vision.obstacle_detector', 'vision.navigation.foe_detector',
+                       'vision.visual_odometry'):
+            start = time.perf_counter()
+            importlib.import_module(module)
+            print(f"✓ {module} kernels ready ({time.perf_counter() - start:.2f}s)")
@@ -5,21 +5,51 @@ Visual Odometry for HS260 Drone.
 Tracks ORB features across frames to estimate camera motion and build trajectory.
 """
 
+import concurrent.futures
 import cv2
 import numpy as np
-from collections import deque
+
+from .utils.jit import njit, NUMBA_AVAILABLE
+
+
+# Eager signatures: distances are int32 from batchDistance (CPU) or float32
+# from the CUDA matcher; indices are int32. Compiled at import, no first-frame stall.
+_FILTER_MATCHES_SIGNATURES = [
+    'UniTuple(int32[::1], 2)({0}[:], {0}[:], int32[:], int32[:], float64)'.format(t)
+    for t in ('int32', 'float32')
+]
+
+
+@njit(_FILTER_MATCHES_SIGNATURES, boundscheck=False, cache=True)
+def filter_matches(dists_a, dists_b, qidx, tidx, ratio):
+    """Lowe's ratio test: compacted (query, train) indices of the matches that pass."""
+    n = dists_a.shape[0]
+    q_out = np.empty(n, dtype=np.int32)
+    t_out = np.empty(n, dtype=np.int32)
+    count = 0
+    for i in range(n):
+        if dists_a[i] < ratio * dists_b[i]:
+            q_out[count] = qidx[i]
+            t_out[count] = tidx[i]
+            count += 1
+    return q_out[:count].copy(), t_out[:count].copy()
 
 
 class VisualOdometry:
     """Monocular visual odometry using ORB features."""
     
-    def __init__(self, focal_length=800, pp=(640, 360)):
+    def __init__(self, focal_length=800, pp=(640, 360), use_cuda=None, detect_scale=0.5,
+                 async_pose=True):
         """
         Initialize visual odometry.
         
         Args:
             focal_length: Camera focal length in pixels (estimated)
             pp: Principal point (cx, cy) - image center
+            use_cuda: Run ORB + Hamming matching on the GPU (cv2.cuda); None = if available
+            detect_scale: Resize factor applied before ORB (0.5 = 640x360 for 720p)
+            async_pose: Run RANSAC pose estimation on a worker thread, overlapped
+                with the next frame's ORB (motion is reported one frame late)
         """
         # Camera intrinsics (estimated for 1280x720)
         self.focal_length = focal_length
@@ -30,17 +60,55 @@ class VisualOdometry:
             [0, 0, 1]
         ], dtype=np.float32)
         
-        # ORB detector and matcher
-        self.orb = cv2.ORB_create(nfeatures=1000, scaleFactor=1.2, nlevels=8)
-        self.matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=False)
+        # Features are detected (and poses estimated) at detect_scale; the
+        # essential-matrix geometry is unchanged once K is scaled to match
+        self.detect_scale = detect_scale
+        self.K_detect = self.K.copy()
+        self.K_detect[:2, :] *= detect_scale
+        
+        # Points are normalized once with K_detect^-1 so the essential-matrix
+        # solvers run with an identity camera (no per-call re-normalization)
+        self.K_inv = np.linalg.inv(self.K_detect).astype(np.float32)
+        self._eye3 = np.eye(3)
+        self._ransac_threshold = 1.0 / focal_length  # 1 full-resolution px, normalized units
+        
+        # ORB parameters: 4 pyramid levels (scale up to 1.2^3) are enough for
+        # frame-to-frame motion at 720p; the top levels of 8 mostly add cost
+        self.orb_params = dict(nfeatures=1000, scaleFactor=1.2, nlevels=4, fastThreshold=20)
+        
+        # ORB detector and matcher (CUDA build: descriptors stay in GPU memory
+        # between frames and are matched there)
+        self._use_cuda = use_cuda is not False and self._cuda_available()
+        if self._use_cuda:
+            self.orb = cv2.cuda.ORB_create(**self.orb_params)
+            self.matcher = cv2.cuda.DescriptorMatcher_createBFMatcher(cv2.NORM_HAMMING)
+            self._gpu_frame = cv2.cuda_GpuMat()
+            print("✓ CUDA ORB enabled")
+        else:
+            self.orb = cv2.ORB_create(**self.orb_params)
+            self.matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=False)
         
         # Previous frame data
+        self._gray_bufs = [None, None]  # Ping-pong grayscale buffers (prev_frame is one)
         self.prev_frame = None
         self.prev_kp = None
+        self.prev_kp_xy = None  # (N, 2) float32 keypoint coordinates of prev_kp
         self.prev_desc = None
         
+        # Matched-point buffers, reused every frame (matches <= nfeatures)
+        self._pts1 = np.empty((4096, 2), dtype=np.float32)
+        self._pts2 = np.empty((4096, 2), dtype=np.float32)
+        
+        # Pose worker: OpenCV drops the GIL in findEssentialMat, so frame N's
+        # RANSAC runs while frame N+1 is detected and matched
+        self._pose_executor = (concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='vo-pose') if async_pose else None)
+        self._pending_pose = None  # Future for the previous frame pair's pose
+        
         # Trajectory tracking
-        self.trajectory = deque(maxlen=500)  # Store last 500 positions
+        self._traj_ring = np.zeros((500, 3))  # Ring buffer of the last 500 positions
+        self._traj_head = 0  # Next slot to write
+        self._traj_fill = 0  # Valid rows in the ring
         self.current_pos = np.zeros(3)  # [x, y, z]
         self.current_rot = np.eye(3)
         
@@ -67,13 +135,19 @@ class VisualOdometry:
         Returns:
             dict with: matches, motion, position, trajectory_overlay
         """
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        gray = self._to_gray(frame)
+        if self.detect_scale != 1.0:
+            gray = cv2.resize(gray, None, fx=self.detect_scale, fy=self.detect_scale,
+                              interpolation=cv2.INTER_AREA)
         
-        # Detect features
-        kp, desc = self.orb.detectAndCompute(gray, None)
+        # Detect features (coordinates are in detect_scale pixels)
+        kp, desc = self._detect_and_compute(gray)
+        kp_xy = self._keypoint_coords(kp)
         
         result = {
             'keypoints': kp,
+            'keypoints_xy': kp_xy,
+            'prev_keypoints_xy': self.prev_kp_xy,  # Query side of 'matches'
             'matches': [],
             'motion': None,
             'position': self.current_pos.copy(),
@@ -85,97 +159,255 @@ class VisualOdometry:
         if self.prev_frame is None:
             self.prev_frame = gray
             self.prev_kp = kp
+            self.prev_kp_xy = kp_xy
             self.prev_desc = desc
-            self.trajectory.append(self.current_pos.copy())
+            self._append_trajectory(self.current_pos)
             return result
         
         # Match features with previous frame
-        if desc is not None and self.prev_desc is not None and len(desc) > 0 and len(self.prev_desc) > 0:
+        if self._num_descriptors(desc) > 0 and self._num_descriptors(self.prev_desc) > 0:
             try:
-                matches = self.matcher.knnMatch(self.prev_desc, desc, k=2)
+                best_dist, second_dist, query_idx, train_idx = self._knn_match(self.prev_desc, desc)
             except cv2.error:
                 # Not enough descriptors
+                self._collect_pose(result)
                 self.prev_frame = gray
                 self.prev_kp = kp
+                self.prev_kp_xy = kp_xy
                 self.prev_desc = desc
                 self.total_frames += 1
                 return result
             
             # Lowe's ratio test
-            good_matches = []
-            for match_pair in matches:
-                if len(match_pair) == 2:
-                    m, n = match_pair
-                    if m.distance < 0.75 * n.distance:
-                        good_matches.append(m)
+            if NUMBA_AVAILABLE:
+                query_idx, train_idx = filter_matches(best_dist, second_dist, query_idx, train_idx, 0.75)
+            else:
+                keep = best_dist < 0.75 * second_dist
+                query_idx = query_idx[keep]
+                train_idx = train_idx[keep]
+            good_matches = np.stack([query_idx, train_idx], axis=1)  # (M, 2) [query, train]
             
             result['matches'] = good_matches
             result['num_matches'] = len(good_matches)
             
+            # Pose of the previous frame pair (worker has been running RANSAC
+            # while this frame was detected and matched)
+            self._collect_pose(result)
+            
             # Need at least 8 points for essential matrix
             if len(good_matches) >= 8:
-                # Extract matched point coordinates
-                pts1 = np.float32([self.prev_kp[m.queryIdx].pt for m in good_matches])
-                pts2 = np.float32([kp[m.trainIdx].pt for m in good_matches])
+                # Extract matched point coordinates (gather into the preallocated buffers;
+                # safe to overwrite, the worker is idle after _collect_pose)
+                n = len(good_matches)
+                if n > len(self._pts1):
+                    self._pts1 = np.empty((n, 2), dtype=np.float32)
+                    self._pts2 = np.empty((n, 2), dtype=np.float32)
+                pts1 = self._pts1[:n]
+                pts2 = self._pts2[:n]
+                np.take(self.prev_kp_xy, query_idx, axis=0, out=pts1)
+                np.take(kp_xy, train_idx, axis=0, out=pts2)
                 
-                # Estimate essential matrix
-                E, mask = cv2.findEssentialMat(pts2, pts1, self.K, 
-                                              method=cv2.RANSAC, 
-                                              prob=0.999, 
-                                              threshold=1.0)
+                # Normalize in place: x_n = (x - c) / f
+                for pts in (pts1, pts2):
+                    pts *= self.K_inv[0, 0], self.K_inv[1, 1]
+                    pts += self.K_inv[0, 2], self.K_inv[1, 2]
                 
-                if E is not None:
-                    # Recover pose
-                    _, R, t, mask = cv2.recoverPose(E, pts2, pts1, self.K, mask=mask)
-                    
-                    inlier_count = int(mask.sum())
-                    
-                    # Check if motion is significant (filter noise)
-                    translation_magnitude = np.linalg.norm(t)
-                    rotation_magnitude = np.linalg.norm(R - np.eye(3))
-                    
-                    is_moving = (translation_magnitude > self.min_translation or 
-                                rotation_magnitude > self.min_rotation) and \
-                               inlier_count >= self.min_inliers
-                    
-                    if is_moving:
-                        # Update position (scale unknown - use constant)
-                        self.current_pos += self.current_rot.dot(t.ravel()) * self.scale
-                        self.current_rot = R.dot(self.current_rot)
-                        
-                        self.trajectory.append(self.current_pos.copy())
-                        
-                        result['motion'] = {
-                            'rotation': R,
-                            'translation': t,
-                            'inliers': inlier_count,
-                            'moving': True,
-                            't_mag': translation_magnitude,
-                            'r_mag': rotation_magnitude
-                        }
-                        result['frame_ready'] = True
-                        self.good_frames += 1
-                    else:
-                        # Stationary - don't update position
-                        result['motion'] = {
-                            'rotation': R,
-                            'translation': t,
-                            'inliers': inlier_count,
-                            'moving': False,
-                            't_mag': translation_magnitude,
-                            'r_mag': rotation_magnitude
-                        }
-                        result['frame_ready'] = True
-                        self.stationary_frames += 1
+                if self._pose_executor is not None:
+                    self._pending_pose = self._pose_executor.submit(self._estimate_pose, pts1, pts2)
+                else:
+                    self._apply_pose(self._estimate_pose(pts1, pts2), result)
+        else:
+            self._collect_pose(result)
         
         # Update previous frame
         self.prev_frame = gray
         self.prev_kp = kp
+        self.prev_kp_xy = kp_xy
         self.prev_desc = desc
         self.total_frames += 1
         
         return result
     
+    def _estimate_pose(self, pts1, pts2):
+        """
+        Essential matrix (RANSAC) and relative pose from normalized matches.
+        
+        Runs on the pose worker thread when async_pose is enabled.
+        
+        Returns:
+            (R, t, inlier_count), or None if no essential matrix was found.
+            R and t are None when there are too few RANSAC inliers to count
+            as motion (recoverPose is skipped)
+        """
+        E, mask = cv2.findEssentialMat(pts2, pts1, self._eye3, 
+                                      method=cv2.RANSAC, 
+                                      prob=0.999, 
+                                      threshold=self._ransac_threshold)
+        if E is None:
+            return None
+        
+        # recoverPose's cheirality check only removes inliers, so below
+        # min_inliers here the frame is stationary whatever R and t are
+        inlier_count = int(np.count_nonzero(mask))
+        if inlier_count < self.min_inliers:
+            return None, None, inlier_count
+        
+        # Recover pose
+        _, R, t, mask = cv2.recoverPose(E, pts2, pts1, self._eye3, mask=mask)
+        return R, t, int(mask.sum())
+    
+    def _collect_pose(self, result):
+        """Wait for the in-flight pose estimate (if any) and apply it to result."""
+        if self._pending_pose is None:
+            return
+        pose = self._pending_pose.result()
+        self._pending_pose = None
+        self._apply_pose(pose, result)
+    
+    def _apply_pose(self, pose, result):
+        """Integrate a relative pose into the trajectory and fill result['motion']."""
+        if pose is None:
+            return
+        R, t, inlier_count = pose
+        if R is None:
+            # Too few inliers to trust: stationary, pose not recovered
+            self.stationary_frames += 1
+            result['motion'] = {'inliers': inlier_count, 'moving': False}
+            result['frame_ready'] = True
+            return
+        
+        # Check if motion is significant (filter noise)
+        translation_magnitude = np.linalg.norm(t)
+        # ||R - I||_F from the trace: ||R - I||^2 = 2 (3 - tr R) for a rotation
+        rotation_magnitude = np.sqrt(max(0.0, 2.0 * (3.0 - R[0, 0] - R[1, 1] - R[2, 2])))
+        
+        is_moving = (translation_magnitude > self.min_translation or 
+                    rotation_magnitude > self.min_rotation) and \
+                   inlier_count >= self.min_inliers
+        
+        if is_moving:
+            # Update position (scale unknown - use constant)
+            self.current_pos += self.current_rot.dot(t.ravel()) * self.scale
+            self.current_rot = R.dot(self.current_rot)
+            
+            self._append_trajectory(self.current_pos)
+            self.good_frames += 1
+        else:
+            # Stationary - don't update position
+            self.stationary_frames += 1
+        
+        result['motion'] = {
+            'rotation': R,
+            'translation': t,
+            'inliers': inlier_count,
+            'moving': bool(is_moving),
+            't_mag': translation_magnitude,
+            'r_mag': rotation_magnitude
+        }
+        result['frame_ready'] = True
+    
+    def close(self):
+        """Apply any in-flight pose estimate and stop the pose worker thread."""
+        if self._pose_executor is None:
+            return
+        self._collect_pose({})
+        self._pose_executor.shutdown(wait=True)
+        self._pose_executor = None
+    
+    @property
+    def trajectory(self):
+        """(N, 3) positions, oldest first (a view unless the ring has wrapped)."""
+        if self._traj_fill < len(self._traj_ring):
+            return self._traj_ring[:self._traj_fill]
+        return np.concatenate((self._traj_ring[self._traj_head:], self._traj_ring[:self._traj_head]))
+    
+    def _append_trajectory(self, pos):
+        """Copy pos into the ring buffer, overwriting the oldest entry when full."""
+        self._traj_ring[self._traj_head] = pos
+        self._traj_head = (self._traj_head + 1) % len(self._traj_ring)
+        self._traj_fill = min(len(self._traj_ring), self._traj_fill + 1)
+    
+    def _to_gray(self, frame):
+        """Grayscale conversion into a reused buffer (alternates so prev_frame stays intact)."""
+        h, w = frame.shape[:2]
+        buf = self._gray_bufs[0]
+        if buf is None or buf.shape != (h, w):
+            buf = np.empty((h, w), dtype=np.uint8)
+        self._gray_bufs.reverse()
+        self._gray_bufs[1] = buf
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=buf)
+    
+    @staticmethod
+    def _cuda_available():
+        """True if OpenCV was built with CUDA ORB and a CUDA device is present."""
+        if not hasattr(cv2, 'cuda') or not hasattr(cv2.cuda, 'ORB_create'):
+            return False
+        try:
+            return cv2.cuda.getCudaEnabledDeviceCount() > 0
+        except cv2.error:
+            return False
+    
+    def _detect_and_compute(self, gray):
+        """
+        ORB keypoints and descriptors.
+        
+        Returns:
+            (keypoints list, descriptors) - descriptors are an ndarray on the
+            CPU path and a cuda_GpuMat (kept on the GPU for matching) with CUDA
+        """
+        if not self._use_cuda:
+            return self.orb.detectAndCompute(gray, None)
+        
+        self._gpu_frame.upload(gray)
+        kp_gpu, desc = self.orb.detectAndComputeAsync(self._gpu_frame, None)
+        kp = self.orb.convert(kp_gpu)
+        return kp, (desc if len(kp) > 0 else None)
+    
+    def _knn_match(self, prev_desc, desc):
+        """
+        Two nearest neighbours in desc for every descriptor in prev_desc.
+        
+        Returns:
+            (best_dist, second_dist, query_idx, train_idx) arrays, one entry per
+            query descriptor that has two neighbours
+        """
+        if self._use_cuda:
+            matches = self.matcher.knnMatch(prev_desc, desc, k=2)
+            pair_arr = np.array([(m.distance, n.distance, m.queryIdx, m.trainIdx)
+                                 for m, n in (mp for mp in matches if len(mp) == 2)],
+                                dtype=np.float32).reshape(-1, 4)
+            return (pair_arr[:, 0], pair_arr[:, 1],
+                    pair_arr[:, 2].astype(np.int32), pair_arr[:, 3].astype(np.int32))
+        
+        # One C call for the sorted 2-NN Hamming distances and indices (what
+        # BFMatcher.knnMatch computes internally), without building DMatch objects
+        dist, nidx = cv2.batchDistance(prev_desc, desc, cv2.CV_32S,
+                                       normType=cv2.NORM_HAMMING, K=2)
+        if nidx.ndim < 2 or nidx.shape[1] < 2:
+            # Fewer than two train descriptors: no query has a second neighbour
+            empty_dist = np.empty(0, dtype=dist.dtype)
+            empty_idx = np.empty(0, dtype=np.int32)
+            return empty_dist, empty_dist, empty_idx, empty_idx
+        valid = np.flatnonzero(nidx[:, 1] >= 0)
+        return (dist[valid, 0], dist[valid, 1],
+                valid.astype(np.int32), nidx[valid, 0])
+    
+    @staticmethod
+    def _num_descriptors(desc):
+        """Descriptor count for an ndarray or cuda_GpuMat (0 for None)."""
+        if desc is None:
+            return 0
+        if isinstance(desc, np.ndarray):
+            return len(desc)
+        return desc.size()[1]  # GpuMat.size() is (cols, rows)
+    
+    @staticmethod
+    def _keypoint_coords(kp):
+        """(N, 2) float32 keypoint coordinates in one C call."""
+        if len(kp) == 0:
+            return np.empty((0, 2), dtype=np.float32)
+        return cv2.KeyPoint_convert(kp)
+    
     def draw_trajectory(self, frame, scale=10, offset=(100, 500)):
         """
         Draw 2D trajectory overlay on frame.
@@ -185,25 +417,24 @@ class VisualOdometry:
             scale: Pixels per unit distance
             offset: (x, y) offset for trajectory center
         """
-        if len(self.trajectory) < 2:
+        if self._traj_fill < 2:
             return frame
         
-        # Draw trajectory path
-        for i in range(1, len(self.trajectory)):
-            p1 = self.trajectory[i-1]
-            p2 = self.trajectory[i]
-            
-            # Convert 3D position to 2D screen coords (top-down view: x, z)
-            pt1 = (int(offset[0] + p1[0] * scale), 
-                   int(offset[1] - p1[2] * scale))
-            pt2 = (int(offset[0] + p2[0] * scale), 
-                   int(offset[1] - p2[2] * scale))
-            
-            # Color gradient (newer = brighter green)
-            alpha = i / len(self.trajectory)
-            color = (0, int(100 + 155 * alpha), 0)
-            
-            cv2.line(frame, pt1, pt2, color, 2)
+        # Convert 3D positions to 2D screen coords in one pass (top-down view: x, z)
+        traj = self.trajectory
+        n = len(traj)
+        pts = np.empty((n, 2), dtype=np.int32)
+        pts[:, 0] = (offset[0] + traj[:, 0] * scale).astype(np.int32)
+        pts[:, 1] = (offset[1] - traj[:, 2] * scale).astype(np.int32)
+        
+        # Color gradient (newer = brighter green): segment i ends at point i.
+        # Consecutive segments sharing a shade go out as one polyline.
+        green = (100 + 155 * np.arange(1, n) / n).astype(np.int32)
+        run_starts = np.flatnonzero(np.diff(green, prepend=-1))
+        run_ends = np.append(run_starts[1:], n - 1)
+        for start, end, g in zip(run_starts.tolist(), run_ends.tolist(), green[run_starts].tolist()):
+            # Segments start+1 .. end span points start .. end
+            cv2.polylines(frame, [pts[start:end + 1]], False, (0, g, 0), 2)
         
         # Draw current position
         curr_pt = (int(offset[0] + self.current_pos[0] * scale),
@@ -226,25 +457,20 @@ class VisualOdometry:
             frame: BGR image
             result: Result dict from process_frame()
         """
-        if not result.get('matches') or self.prev_kp is None:
-            return frame
-        
-        if not result.get('keypoints') or len(result['keypoints']) == 0:
+        if len(result.get('matches', ())) == 0 or result.get('prev_keypoints_xy') is None:
             return frame
         
         # Draw subset of matches (avoid clutter)
         step = max(1, len(result['matches']) // 50)
+        shown = result['matches'][::step]
         
-        for i, match in enumerate(result['matches'][::step]):
-            try:
-                pt1 = tuple(map(int, self.prev_kp[match.queryIdx].pt))
-                pt2 = tuple(map(int, result['keypoints'][match.trainIdx].pt))
-                
-                # Draw motion vector
-                cv2.arrowedLine(frame, pt1, pt2, (0, 255, 255), 1, tipLength=0.3)
-            except (IndexError, AttributeError):
-                # Skip invalid matches
-                continue
+        # Keypoints are at detect_scale; map back to frame pixels
+        prev_pts = (result['prev_keypoints_xy'][shown[:, 0]] / self.detect_scale).astype(np.int32)
+        curr_pts = (result['keypoints_xy'][shown[:, 1]] / self.detect_scale).astype(np.int32)
+        
+        for pt1, pt2 in zip(prev_pts.tolist(), curr_pts.tolist()):
+            # Draw motion vector
+            cv2.arrowedLine(frame, pt1, pt2, (0, 255, 255), 1, tipLength=0.3)
         
         return frame
     
@@ -255,7 +481,7 @@ class VisualOdometry:
             'good_frames': self.good_frames,
             'stationary_frames': self.stationary_frames,
             'success_rate': self.good_frames / max(1, self.total_frames),
-            'trajectory_length': len(self.trajectory),
+            'trajectory_length': self._traj_fill,
             'distance_traveled': np.linalg.norm(self.current_pos),
             'position': self.current_pos.tolist()
         }
@@ -11,6 +11,7 @@ Architecture:
 
 import threading
 import queue
+import concurrent.futures
 import websocket
 import av
 import numpy as np
@@ -18,23 +19,258 @@ import cv2
 import time
 from http.server import BaseHTTPRequestHandler, HTTPServer
 import io
+import socket
+import struct
 import sys
 import os
+import asyncio
+import urllib.parse
+from av.video.reformatter import VideoReformatter
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from vision.stream_decoder import create_codec, create_hwaccel, luma_plane
+from vision.utils.jit import njit, NUMBA_AVAILABLE
 from vision.visual_odometry import VisualOdometry
 from vision.obstacle_detector_fast import FastObstacleDetector
 from autopilot import AutopilotController
 
+try:
+    from aiohttp import web  # Optional: async MJPEG server (one thread for all clients)
+except ImportError:
+    web = None
+
+try:
+    import uvloop  # Optional: faster event loop for AsyncMJPEGServer
+except ImportError:
+    uvloop = None
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_GRAY, TJSAMP_GRAY  # Optional: libjpeg-turbo SIMD encoder
+except ImportError:
+    TurboJPEG = None
+
+_NAL_LENGTH = struct.Struct('>I')  # 4-byte big-endian NAL length prefix
+_START_CODE = b'\x00\x00\x00\x01'  # Annex B start code (same size as the prefix)
+_MAX_NAL_LENGTH = 100000  # Larger length prefixes are treated as malformed
+JPEG_QUALITY = 85  # Colour MJPEG stream
+GRAY_JPEG_QUALITY = 75  # Luma-only stream (/stream?gray=1)
+_MJPEG_PART = b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n%s\r\n'  # % (len, jpeg)
+
+
+@njit('intp(uint8[::1], intp, int32[:, ::1])', boundscheck=False, cache=True)
+def _scan_nals(buf, offset, spans):
+    """
+    Scan length-prefixed NAL units from offset, rewriting prefixes to start codes.
+    
+    Writes (offset, length) pairs into spans and stops at the first malformed
+    prefix or when spans is full.
+    
+    Returns:
+        Number of spans written
+    """
+    size = buf.shape[0]
+    count = 0
+    while offset + 4 < size and count < spans.shape[0]:
+        length = ((buf[offset] << 24) | (buf[offset + 1] << 16) |
+                  (buf[offset + 2] << 8) | buf[offset + 3])
+        end = offset + 4 + length
+        if length <= 0 or length > _MAX_NAL_LENGTH or end > size:
+            break
+        buf[offset] = 0
+        buf[offset + 1] = 0
+        buf[offset + 2] = 0
+        buf[offset + 3] = 1
+        spans[count, 0] = offset
+        spans[count, 1] = length
+        count += 1
+        offset = end
+    return count
+
+
+def _create_jpeg_encoder():
+    """TurboJPEG instance, or None if PyTurboJPEG / libturbojpeg is missing."""
+    if TurboJPEG is None:
+        return None
+    try:
+        return TurboJPEG()
+    except (OSError, RuntimeError) as e:
+        print(f"⚠ libturbojpeg unavailable ({e}), using cv2.imencode")
+        return None
+
+
+_jpeg_encoder = _create_jpeg_encoder()
+
+
+def encode_jpeg(frame, quality=85):
+    """
+    Encode a BGR (or single-channel grayscale) frame as JPEG.
+    
+    Uses libjpeg-turbo's TurboJPEG API directly when PyTurboJPEG is installed,
+    otherwise cv2.imencode.
+    
+    Returns:
+        JPEG bytes, or None if encoding failed
+    """
+    if _jpeg_encoder is not None:
+        if frame.ndim == 2:
+            return _jpeg_encoder.encode(frame, quality=quality,
+                                        pixel_format=TJPF_GRAY, jpeg_subsample=TJSAMP_GRAY)
+        return _jpeg_encoder.encode(frame, quality=quality)
+    ret, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return jpeg.tobytes() if ret else None
+
+
+def encode_stream_frame(frame, gray=False):
+    """
+    Encode a processed frame for the MJPEG stream.
+    
+    Args:
+        frame: BGR image
+        gray: Encode luma only (no chroma planes: smaller and faster to encode)
+    
+    Returns:
+        JPEG bytes, or None if encoding failed
+    """
+    if gray:
+        return encode_jpeg(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), GRAY_JPEG_QUALITY)
+    return encode_jpeg(frame, JPEG_QUALITY)
+
+
+def configure_opencv():
+    """
+    Enable OpenCV's optimized (SIMD-dispatched) kernels and size its thread pool.
+    
+    Two cores are left for the H.264 decoder and the WebSocket/HTTP threads.
+    Prints the SIMD baseline/dispatch and parallel backend the build has; a
+    build without AVX2 in either list should be rebuilt with
+    -D CPU_DISPATCH=AVX2,AVX512_SKX.
+    """
+    cv2.setUseOptimized(True)
+    cv2.setNumThreads(max(1, (os.cpu_count() or 1) - 2))
+    
+    build_info = {}
+    for line in cv2.getBuildInformation().splitlines():
+        key, _, value = line.strip().partition(':')
+        if key in ('Baseline', 'Dispatched code generation', 'Parallel framework'):
+            build_info[key] = value.strip()
+    print(f"✓ OpenCV {cv2.__version__}: optimized={cv2.useOptimized()}, "
+          f"threads={cv2.getNumThreads()}, parallel={build_info.get('Parallel framework', '?')}")
+    print(f"  SIMD baseline: {build_info.get('Baseline', '?')}")
+    print(f"  SIMD dispatch: {build_info.get('Dispatched code generation', '?')}")
+
+
+# Browser viewer page (served by both HTTP server implementations)
+VIEWER_HTML = """<!DOCTYPE html>
+<html>
+<head>
+    <title>HS260 Vision Processing</title>
+    <style>
+        body {
+            margin: 0;
+            padding: 20px;
+            background: #1a1a1a;
+            color: #fff;
+            font-family: 'Courier New', monospace;
+        }
+        h1 {
+            color: #0f0;
+            text-align: center;
+        }
+        .container {
+            max-width: 1400px;
+            margin: 0 auto;
+        }
+        .video-container {
+            background: #000;
+            padding: 20px;
+            border: 2px solid #0f0;
+            border-radius: 8px;
+        }
+        img {
+            width: 100%;
+            height: auto;
+            display: block;
+        }
+        img.gray {
+            /* Tint the luma-only stream so overlays don't read as plain grey */
+            filter: sepia(1) hue-rotate(60deg) saturate(2);
+        }
+        .info {
+            margin-top: 20px;
+            padding: 15px;
+            background: #2a2a2a;
+            border-left: 4px solid #0f0;
+        }
+        .info p {
+            margin: 5px 0;
+        }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <h1>🚁 HS260 Vision Processing</h1>
+        
+        <div class="video-container">
+            <img id="stream" alt="Processed Video Stream">
+        </div>
+        
+        <div class="info">
+            <p><strong>Status:</strong> <span style="color: #0f0;">● LIVE</span></p>
+            <p><strong>Processing:</strong> Obstacle Detection (+ Visual Odometry when started with --vo)</p>
+            <p><strong>Stream:</strong> MJPEG @ ~30 FPS (<a href="/?gray=1" style="color: #0f0;">luma only</a>)</p>
+            <p><strong>Features:</strong></p>
+            <ul style="margin: 5px 0; padding-left: 20px;">
+                <li><strong style="color: #f00;">Red zones</strong> = Approaching obstacles (DANGER)</li>
+                <li><strong style="color: #ffa500;">Orange zones</strong> = Obstacles detected (CAUTION)</li>
+                <li><strong style="color: #0f0;">Green arrows</strong> = Safe flight directions</li>
+                <li><strong style="color: #f00;">Red arrows</strong> = Blocked directions</li>
+                <li>Green circles = Tracked features</li>
+                <li>Command = Recommended flight action</li>
+            </ul>
+        </div>
+    </div>
+    <script>
+        // /?gray=1 switches to the luma-only stream
+        var gray = new URLSearchParams(location.search).get('gray') === '1';
+        var img = document.getElementById('stream');
+        img.src = gray ? '/stream?gray=1' : '/stream';
+        if (gray) img.className = 'gray';
+    </script>
+</body>
+</html>"""
+
+# Encoded once at import; served as-is on every GET /
+VIEWER_HTML_BYTES = VIEWER_HTML.encode('utf-8')
+_VIEWER_HTML_HEADERS = (
+    ('Content-type', 'text/html; charset=utf-8'),
+    ('Content-length', str(len(VIEWER_HTML_BYTES))),
+)
+
 
 class VisionProcessor:
     """Processes video frames with OpenCV and outputs MJPEG stream."""
     
-    def __init__(self, websocket_url="ws://localhost:9000/stream"):
+    def __init__(self, websocket_url="ws://localhost:9000/stream", hwaccel=True, use_vo=False):
+        """
+        Initialize processor.
+        
+        Args:
+            websocket_url: Android app's H.264 WebSocket stream
+            hwaccel: Try hardware H.264 decoding (falls back to software)
+            use_vo: Also run visual odometry and draw its trajectory/matches
+        """
         self.websocket_url = websocket_url
-        self.frame_queue = queue.Queue(maxsize=2)  # Small buffer for latest frames
+        self.frame_queue = queue.Queue(maxsize=30)  # Raw WebSocket messages (~1 s of video)
         self.processed_frame = None
+        self.frame_id = 0  # Increments with every published processed_frame
+        self._frame_cond = threading.Condition()  # Notified on every new frame
+        self._frame_listeners = []  # Callbacks run (on the worker) for every new frame
+        self._jpeg_lock = threading.Lock()  # One encode per frame and variant, shared by all clients
+        self._jpeg_cache = {}  # gray flag -> JPEG bytes of frame _jpeg_cache_id
+        self._jpeg_cache_id = 0
         self.running = False
         self.codec = None
+        self.hwaccel = create_hwaccel() if hwaccel else None  # VideoToolbox/CUDA/VAAPI
+        self._reformatter = VideoReformatter()  # Reuses one swscale context for all frames
         
         # Stats
         self.fps = 0.0
@@ -42,17 +278,29 @@ class VisionProcessor:
         self.last_fps_time = time.time()
         self.total_frames = 0
         self.message_count = 0
+        self.messages_decoded = 0
+        self.frames_decoded = 0
+        self.frames_dropped = 0  # Decoded but skipped: processing worker was busy
         self.nal_count = 0
+        self._nal_spans = np.empty((64, 2), dtype=np.int32)  # _scan_nals output
+        
+        # OpenCV processing worker: frame N is processed while frame N+1 decodes
+        # (OpenCV drops the GIL)
+        self._process_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='vision-process'
+        )
+        self._pending_process = None  # Future of the frame being processed
         
-        # Visual odometry
-        self.vo = VisualOdometry(focal_length=800, pp=(640, 360))
+        # Visual odometry (optional: obstacle detection alone drives the autopilot)
+        self.vo = VisualOdometry(focal_length=800, pp=(640, 360)) if use_vo else None
         
         # Fast obstacle detector
         self.obstacle_detector = FastObstacleDetector(grid_size=(4, 3))
         
-        # Latest obstacle detection result (for autopilot)
+        # Latest obstacle detection result (for autopilot).
+        # Published by rebinding the attribute (atomic in CPython); the
+        # result dict is never mutated afterwards, so readers need no lock.
         self.latest_obstacle_result = None
-        self.result_lock = threading.Lock()
         
         # Autopilot controller (disabled by default)
         self.autopilot = AutopilotController(
@@ -63,71 +311,119 @@ class VisionProcessor:
         self.autopilot_enabled = False
         
     def _parse_nal_units(self, data):
-        """Parse length-prefixed NAL units from WebSocket message."""
+        """
+        Parse NAL units from WebSocket message.
+        
+        The Android app sends one bare NAL unit per message, which only needs
+        the start code prepended. A length-prefixed message is copied once and
+        each 4-byte length prefix is overwritten in place with the Annex B
+        start code PyAV expects, so every unit is a view into that one copy
+        (no per-NAL concatenation).
+        
+        Returns:
+            List of Annex B NAL units (start code + NAL data)
+        """
+        size = len(data)
+        
+        # Bare NAL unit (DebugApiServer.sendH264Packet): its header byte is
+        # nonzero, so it can never read as a valid first length prefix
+        if size <= 4 or not 0 < _NAL_LENGTH.unpack_from(data)[0] <= min(_MAX_NAL_LENGTH, size - 4):
+            return [_START_CODE + data]
+        
         nal_units = []
         offset = 0
+        buf = bytearray(data)
+        view = memoryview(buf)
         
-        # Parse 4-byte big-endian length-prefixed NAL units
-        while offset + 4 < len(data):
-            length = (data[offset] << 24) | (data[offset+1] << 16) | \
-                    (data[offset+2] << 8) | data[offset+3]
-            
-            if length > 0 and length <= 100000 and offset + 4 + length <= len(data):
-                nal_unit = data[offset + 4 : offset + 4 + length]
-                nal_units.append(bytes(nal_unit))
-                offset += 4 + length
-            else:
-                break
-        
-        # If parsing failed, treat entire message as one NAL unit
-        if not nal_units:
-            nal_units.append(bytes(data))
+        if NUMBA_AVAILABLE:
+            # Compiled scan; repeats only if a message has more units than spans holds
+            arr = np.frombuffer(buf, dtype=np.uint8)
+            spans = self._nal_spans
+            while True:
+                count = _scan_nals(arr, offset, spans)
+                for start, length in spans[:count].tolist():
+                    nal_units.append(view[start:start + 4 + length])
+                if count < len(spans):
+                    break
+                offset = int(spans[-1, 0] + 4 + spans[-1, 1])
+        else:
+            # Parse 4-byte big-endian length-prefixed NAL units (one C call per length)
+            while offset + 4 < size:
+                length, = _NAL_LENGTH.unpack_from(buf, offset)
+                end = offset + 4 + length
+                
+                if length > 0 and length <= _MAX_NAL_LENGTH and end <= size:
+                    buf[offset:offset + 4] = _START_CODE
+                    nal_units.append(view[offset:end])
+                    offset = end
+                else:
+                    break
         
         return nal_units
     
+    def _create_codec(self):
+        """Create the H.264 decoder (see create_codec)."""
+        codec, self.hwaccel = create_codec(self.hwaccel)
+        return codec
+    
     def _decode_nal(self, nal_data):
-        """Decode H.264 NAL unit to frame."""
+        """
+        Decode H.264 NAL unit to frame.
+        
+        Args:
+            nal_data: Annex B NAL unit from _parse_nal_units()
+        
+        Returns:
+            (bgr, gray) arrays, or None if no frame was produced. gray is the
+            decoder's luma plane, so no BGR->gray conversion is needed.
+        """
         try:
             if self.codec is None:
-                self.codec = av.CodecContext.create('h264', 'r')
+                self.codec = self._create_codec()
             
-            # Log NAL type for debugging
-            nal_type = nal_data[0] & 0x1F
+            # Log NAL type for debugging (header byte follows the start code)
+            nal_type = nal_data[4] & 0x1F
             if self.nal_count < 20:
                 nal_names = {1: 'P-frame', 5: 'IDR/I-frame', 6: 'SEI', 
                            7: 'SPS', 8: 'PPS', 9: 'AUD'}
                 nal_name = nal_names.get(nal_type, f'Type {nal_type}')
-                print(f"  NAL #{self.nal_count}: {nal_name} ({len(nal_data)} bytes)")
+                print(f"  NAL #{self.nal_count}: {nal_name} ({len(nal_data) - 4} bytes)")
             self.nal_count += 1
             
-            # Convert to Annex B format (add start code)
-            # PyAV expects: 00 00 00 01 + NAL data
-            annex_b_data = b'\x00\x00\x00\x01' + nal_data
-            
-            packet = av.Packet(annex_b_data)
+            packet = av.Packet(nal_data)
             frames = self.codec.decode(packet)
             
             for frame in frames:
-                img = frame.to_ndarray(format='rgb24')
-                img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
-                return img
+                # Convert straight to BGR (no rgb24 + cvtColor round-trip)
+                bgr = self._reformatter.reformat(frame, format='bgr24').to_ndarray()
+                return bgr, luma_plane(frame)
         except Exception as e:
             # Log errors for first few NAL units
             if self.nal_count < 10:
                 print(f"  Decode error: {e.__class__.__name__}: {e}")
         return None
     
-    def _process_frame(self, frame):
-        """Apply OpenCV processing to frame."""
-        # Run obstacle detection only (faster)
-        obstacle_result = self.obstacle_detector.analyze_frame(frame)
+    def _process_frame(self, frame, gray=None):
+        """
+        Apply OpenCV processing to frame.
+        
+        Args:
+            frame: BGR image
+            gray: Optional grayscale of frame (e.g. the decoder's luma plane)
+        """
+        # Run obstacle detection (plus visual odometry, if enabled)
+        obstacle_result = self.obstacle_detector.analyze_frame(frame, gray=gray)
+        vo_result = self.vo.process_frame(frame) if self.vo is not None else None
         
         # Store latest result for autopilot
-        with self.result_lock:
-            self.latest_obstacle_result = obstacle_result
+        self.latest_obstacle_result = obstacle_result
         
-        # Draw obstacle overlay
-        output = self.obstacle_detector.draw_overlay(frame, obstacle_result)
+        # Draw obstacle overlay in place: each decoded frame is a fresh array that
+        # nothing else reads, so the per-frame copy isn't needed
+        output = self.obstacle_detector.draw_overlay(frame, obstacle_result, dst=frame)
+        if vo_result is not None:
+            self.vo.draw_matches(output, vo_result)
+            self.vo.draw_trajectory(output)
         
         # Overlay FPS
         fps_text = f"FPS: {self.fps:.1f}"
@@ -154,37 +450,86 @@ class VisionProcessor:
         return output
     
     def _on_message(self, ws, message):
-        """WebSocket message handler."""
+        """WebSocket message handler - hands the message to the decoder thread."""
         self.message_count += 1
         
         if self.message_count == 1:
             print(f"✓ First message received ({len(message)} bytes)")
         
+        try:
+            self.frame_queue.put_nowait(message)
+        except queue.Full:
+            # Decoder is behind: drop the oldest message to bound latency
+            try:
+                self.frame_queue.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                self.frame_queue.put_nowait(message)
+            except queue.Full:
+                pass
+    
+    def _decode_loop(self):
+        """Decoder thread: parse, decode and process queued messages in order."""
+        while True:
+            message = self.frame_queue.get()
+            if message is None:
+                break
+            try:
+                self._handle_message(message)
+            except Exception as e:
+                print(f"⚠ Frame processing error: {e}")
+    
+    def _handle_message(self, message):
+        """Decode and process every NAL unit in one WebSocket message."""
         # Parse length-prefixed NAL units
         nal_units = self._parse_nal_units(message)
+        self.messages_decoded += 1
         
-        if self.message_count <= 3:
+        if self.messages_decoded <= 3:
             print(f"  Parsed {len(nal_units)} NAL unit(s) from message")
         
         # Decode each NAL unit
         for nal_data in nal_units:
-            frame = self._decode_nal(nal_data)
-            if frame is not None:
-                if self.total_frames == 0:
+            decoded = self._decode_nal(nal_data)
+            if decoded is not None:
+                frame, gray = decoded
+                self.frames_decoded += 1
+                if self.frames_decoded == 1:
                     print(f"✓ First frame decoded ({frame.shape})")
                 
-                # Process frame with OpenCV
-                processed = self._process_frame(frame)
-                self.processed_frame = processed
-                
-                # Update FPS
-                self.total_frames += 1
-                self.frame_count += 1
-                current_time = time.time()
-                if current_time - self.last_fps_time >= 1.0:
-                    self.fps = self.frame_count / (current_time - self.last_fps_time)
-                    self.frame_count = 0
-                    self.last_fps_time = current_time
+                # At most one frame in flight. If the worker is still busy, drop
+                # this frame rather than stall decoding (the codec has already
+                # consumed it as a reference, so later P-frames stay intact)
+                pending = self._pending_process
+                if pending is not None and not pending.done():
+                    self.frames_dropped += 1
+                    continue
+                self._pending_process = None
+                if pending is not None:
+                    pending.result()
+                self._pending_process = self._process_pool.submit(self._process_and_publish, frame, gray)
+    
+    def _process_and_publish(self, frame, gray):
+        """Processing worker: run OpenCV processing, publish the frame, update FPS."""
+        processed = self._process_frame(frame, gray)
+        # _process_frame returns a new array every frame and never touches it again,
+        # so publishing the reference is safe for readers holding older frames
+        with self._frame_cond:
+            self.processed_frame = processed
+            self.frame_id += 1
+            self._frame_cond.notify_all()
+        for listener in self._frame_listeners:
+            listener()
+        
+        # Update FPS
+        self.total_frames += 1
+        self.frame_count += 1
+        current_time = time.time()
+        if current_time - self.last_fps_time >= 1.0:
+            self.fps = self.frame_count / (current_time - self.last_fps_time)
+            self.frame_count = 0
+            self.last_fps_time = current_time
     
     def _on_error(self, ws, error):
         """WebSocket error handler."""
@@ -215,6 +560,11 @@ class VisionProcessor:
     def start(self):
         """Start processing."""
         print(f"Connecting to {self.websocket_url}...")
+        
+        # Decode + OpenCV work runs here, so the socket read callback never blocks on it
+        decoder_thread = threading.Thread(target=self._decode_loop, daemon=True)
+        decoder_thread.start()
+        
         ws_thread = threading.Thread(target=self._websocket_thread, daemon=True)
         ws_thread.start()
         
@@ -236,10 +586,64 @@ class VisionProcessor:
         """Get latest processed frame."""
         return self.processed_frame
     
+    def get_latest_frame_with_id(self):
+        """Get (latest processed frame, its frame_id)."""
+        with self._frame_cond:
+            return self.processed_frame, self.frame_id
+    
+    def wait_for_frame(self, last_id, timeout=1.0):
+        """
+        Block until a frame newer than last_id is published.
+        
+        Args:
+            last_id: frame_id the caller already has (-1 for none)
+            timeout: Maximum seconds to wait
+        
+        Returns:
+            (frame, frame_id) - frame_id == last_id if the wait timed out
+        """
+        with self._frame_cond:
+            self._frame_cond.wait_for(lambda: self.frame_id != last_id and
+                                      self.processed_frame is not None, timeout)
+            return self.processed_frame, self.frame_id
+    
+    def get_latest_jpeg(self, gray=False):
+        """
+        Get the latest processed frame as MJPEG-ready JPEG bytes.
+        
+        The first caller for a new frame encodes it; every other client gets
+        the same bytes, so encoding cost doesn't grow with the client count.
+        
+        Args:
+            gray: Luma-only JPEG (see encode_stream_frame())
+        
+        Returns:
+            (JPEG bytes or None, frame_id)
+        """
+        with self._jpeg_lock:
+            frame, frame_id = self.get_latest_frame_with_id()
+            if frame is None:
+                return None, frame_id
+            if frame_id != self._jpeg_cache_id:
+                self._jpeg_cache = {}
+                self._jpeg_cache_id = frame_id
+            jpeg = self._jpeg_cache.get(gray)
+            if jpeg is None:
+                jpeg = encode_stream_frame(frame, gray)
+                self._jpeg_cache[gray] = jpeg
+            return jpeg, frame_id
+    
+    def add_frame_listener(self, callback):
+        """Call callback() (from the processing thread) whenever a new frame is published."""
+        self._frame_listeners = self._frame_listeners + [callback]
+    
+    def remove_frame_listener(self, callback):
+        """Stop calling a callback registered with add_frame_listener()."""
+        self._frame_listeners = [cb for cb in self._frame_listeners if cb is not callback]
+    
     def get_obstacle_result(self):
         """Get latest obstacle detection result."""
-        with self.result_lock:
-            return self.latest_obstacle_result
+        return self.latest_obstacle_result
     
     def enable_autopilot(self):
         """Enable autopilot navigation."""
@@ -272,8 +676,11 @@ class VisionProcessor:
         # Compute control from vision
         control_cmd = self.autopilot.compute_control(result)
         
-        # Execute with confirmation
-        success = self.autopilot.execute_control(control_cmd)
+        # Execute with confirmation (re-checked against the latest vision result)
+        success = self.autopilot.execute_control(
+            control_cmd,
+            refresh=lambda: self.autopilot.compute_control(self.get_obstacle_result())
+        )
         
         if not success and self.autopilot.emergency_stop:
             print("\n🛑 EMERGENCY STOP TRIGGERED - Disabling autopilot")
@@ -285,21 +692,33 @@ class MJPEGStreamHandler(BaseHTTPRequestHandler):
     
     processor = None  # Will be set by server
     
+    def setup(self):
+        """Disable Nagle: each MJPEG part is one complete write, send it immediately."""
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    
     def log_message(self, format, *args):
         """Suppress HTTP request logs."""
         pass
     
     def do_GET(self):
         """Handle GET requests."""
-        if self.path == '/stream':
-            self.send_mjpeg_stream()
-        elif self.path == '/' or self.path == '/index.html':
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == '/stream':
+            gray = urllib.parse.parse_qs(url.query).get('gray') == ['1']
+            self.send_mjpeg_stream(gray=gray)
+        elif url.path == '/' or url.path == '/index.html':
             self.send_html_page()
         else:
             self.send_error(404)
     
-    def send_mjpeg_stream(self):
-        """Stream MJPEG."""
+    def send_mjpeg_stream(self, gray=False):
+        """
+        Stream MJPEG.
+        
+        Args:
+            gray: Send luma-only JPEGs (/stream?gray=1)
+        """
         self.send_response(200)
         self.send_header('Content-type', 'multipart/x-mixed-replace; boundary=frame')
         self.send_header('Cache-Control', 'no-cache')
@@ -308,107 +727,156 @@ class MJPEGStreamHandler(BaseHTTPRequestHandler):
         print(f"✓ MJPEG client connected from {self.client_address[0]}")
         
         try:
+            last_sent_id = -1
             while True:
-                frame = self.processor.get_latest_frame()
-                if frame is not None:
-                    # Encode frame as JPEG
-                    ret, jpeg = cv2.imencode('.jpg', frame, 
-                                            [cv2.IMWRITE_JPEG_QUALITY, 85])
-                    if ret:
-                        # Send MJPEG frame
-                        self.wfile.write(b'--frame\r\n')
-                        self.send_header('Content-type', 'image/jpeg')
-                        self.send_header('Content-length', len(jpeg))
-                        self.end_headers()
-                        self.wfile.write(jpeg.tobytes())
-                        self.wfile.write(b'\r\n')
-                
-                time.sleep(0.033)  # ~30 FPS
+                # Wake on the next new frame; never resend one already sent
+                _, frame_id = self.processor.wait_for_frame(last_sent_id, timeout=1.0)
+                if frame_id != last_sent_id:
+                    # JPEG shared with the other clients (encoded once per frame)
+                    jpeg, last_sent_id = self.processor.get_latest_jpeg(gray)
+                    if jpeg is not None:
+                        # Send MJPEG frame: part header, JPEG and trailer in one write
+                        self.wfile.write(_MJPEG_PART % (len(jpeg), jpeg))
                 
         except (BrokenPipeError, ConnectionResetError):
             print(f"✗ MJPEG client disconnected from {self.client_address[0]}")
     
     def send_html_page(self):
         """Send HTML viewer page."""
-        html = """<!DOCTYPE html>
-<html>
-<head>
-    <title>HS260 Vision Processing</title>
-    <style>
-        body {
-            margin: 0;
-            padding: 20px;
-            background: #1a1a1a;
-            color: #fff;
-            font-family: 'Courier New', monospace;
-        }
-        h1 {
-            color: #0f0;
-            text-align: center;
-        }
-        .container {
-            max-width: 1400px;
-            margin: 0 auto;
-        }
-        .video-container {
-            background: #000;
-            padding: 20px;
-            border: 2px solid #0f0;
-            border-radius: 8px;
-        }
-        img {
-            width: 100%;
-            height: auto;
-            display: block;
-        }
-        .info {
-            margin-top: 20px;
-            padding: 15px;
-            background: #2a2a2a;
-            border-left: 4px solid #0f0;
-        }
-        .info p {
-            margin: 5px 0;
-        }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>🚁 HS260 Vision Processing (ORB Features)</h1>
-        
-        <div class="video-container">
-            <img src="/stream" alt="Processed Video Stream">
-        </div>
-        
-        <div class="info">
-            <p><strong>Status:</strong> <span style="color: #0f0;">● LIVE</span></p>
-            <p><strong>Processing:</strong> Obstacle Detection + Visual Odometry</p>
-            <p><strong>Stream:</strong> MJPEG @ ~30 FPS</p>
-            <p><strong>Features:</strong></p>
-            <ul style="margin: 5px 0; padding-left: 20px;">
-                <li><strong style="color: #f00;">Red zones</strong> = Approaching obstacles (DANGER)</li>
-                <li><strong style="color: #ffa500;">Orange zones</strong> = Obstacles detected (CAUTION)</li>
-                <li><strong style="color: #0f0;">Green arrows</strong> = Safe flight directions</li>
-                <li><strong style="color: #f00;">Red arrows</strong> = Blocked directions</li>
-                <li>Green circles = ORB features (tracking)</li>
-                <li>Command = Recommended flight action</li>
-            </ul>
-        </div>
-    </div>
-</body>
-</html>"""
         self.send_response(200)
-        self.send_header('Content-type', 'text/html')
+        for keyword, value in _VIEWER_HTML_HEADERS:
+            self.send_header(keyword, value)
         self.end_headers()
-        self.wfile.write(html.encode())
+        self.wfile.write(VIEWER_HTML_BYTES)
 
 
-def main():
-    """Main entry point."""
+class AsyncMJPEGServer:
+    """
+    MJPEG + viewer page server on aiohttp.
+    
+    Serves every client from one event loop thread instead of one thread per
+    connection, and sends each frame's part header + JPEG in a single write.
+    Same serve_forever()/shutdown() interface as http.server.HTTPServer.
+    """
+    
+    def __init__(self, processor, host='localhost', port=8080):
+        """
+        Initialize server.
+        
+        Args:
+            processor: VisionProcessor to stream frames from
+            host: Interface to bind
+            port: TCP port
+        """
+        if web is None:
+            raise ImportError("AsyncMJPEGServer requires aiohttp (pip install aiohttp)")
+        self.processor = processor
+        self.host = host
+        self.port = port
+        self._loop = None
+        self._stop = None
+        self._new_frame = None  # asyncio.Event replaced (after set) on every new frame
+        self._ready = threading.Event()
+    
+    def serve_forever(self):
+        """Run the server until shutdown() (blocks; call from a thread)."""
+        # uvloop's libuv transports cut per-write overhead when installed
+        run = uvloop.run if uvloop is not None else asyncio.run
+        run(self._serve())
+    
+    def shutdown(self):
+        """Stop the server (thread-safe)."""
+        self._ready.wait(timeout=1.0)
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._stop.set)
+    
+    async def _serve(self):
+        """Start the aiohttp site and wait for shutdown."""
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._new_frame = asyncio.Event()
+        self.processor.add_frame_listener(self._on_frame_published)
+        
+        app = web.Application()
+        app.router.add_get('/', self._handle_index)
+        app.router.add_get('/index.html', self._handle_index)
+        app.router.add_get('/stream', self._handle_stream)
+        
+        runner = web.AppRunner(app, handle_signals=False, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, self.host, self.port)
+        await site.start()
+        self._ready.set()
+        try:
+            await self._stop.wait()
+        finally:
+            self.processor.remove_frame_listener(self._on_frame_published)
+            await runner.cleanup()
+    
+    def _on_frame_published(self):
+        """Frame listener (processing thread): wake the stream handlers."""
+        self._loop.call_soon_threadsafe(self._signal_new_frame)
+    
+    def _signal_new_frame(self):
+        """Wake every handler waiting on the current event and start a new one."""
+        self._new_frame.set()
+        self._new_frame = asyncio.Event()
+    
+    async def _handle_index(self, request):
+        """Send HTML viewer page."""
+        return web.Response(body=VIEWER_HTML_BYTES, content_type='text/html', charset='utf-8')
+    
+    async def _handle_stream(self, request):
+        """Stream MJPEG: encode off the event loop, one write per frame."""
+        response = web.StreamResponse(headers={
+            'Content-Type': 'multipart/x-mixed-replace; boundary=frame',
+            'Cache-Control': 'no-cache',
+        })
+        await response.prepare(request)
+        
+        print(f"✓ MJPEG client connected from {request.remote}")
+        loop = asyncio.get_running_loop()
+        gray = request.query.get('gray') == '1'
+        
+        try:
+            last_sent_id = -1
+            while True:
+                # Take the event before reading the frame so a publish in between still wakes us
+                new_frame = self._new_frame
+                frame, frame_id = self.processor.get_latest_frame_with_id()
+                if frame is None or frame_id == last_sent_id:
+                    try:
+                        await asyncio.wait_for(new_frame.wait(), timeout=1.0)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                
+                # JPEG shared with the other clients; the first one to ask encodes
+                # it in the pool thread (the encoder drops the GIL)
+                jpeg, last_sent_id = await loop.run_in_executor(
+                    None, self.processor.get_latest_jpeg, gray
+                )
+                if jpeg is not None:
+                    # Send MJPEG frame: part header, JPEG and trailer in one write
+                    await response.write(_MJPEG_PART % (len(jpeg), jpeg))
+        
+        except ConnectionError:
+            print(f"✗ MJPEG client disconnected from {request.remote}")
+        return response
+
+
+def main(use_vo=False):
+    """
+    Main entry point.
+    
+    Args:
+        use_vo: Also run visual odometry (--vo)
+    """
     print("=== HS260 Vision Processing Server ===\n")
+    configure_opencv()  # Process-wide OpenCV settings, once
     
     # Create vision processor
-    processor = VisionProcessor()
+    processor = VisionProcessor(use_vo=use_vo)
     
     # Start processing
     if not processor.start():
@@ -431,9 +899,12 @@ def main():
     
     print("✓ Receiving and processing frames\n")
     
-    # Start MJPEG HTTP server in separate thread
-    MJPEGStreamHandler.processor = processor
-    server = HTTPServer(('localhost', 8080), MJPEGStreamHandler)
+    # Start MJPEG HTTP server in separate thread (aiohttp when installed)
+    if web is not None:
+        server = AsyncMJPEGServer(processor, 'localhost', 8080)
+    else:
+        MJPEGStreamHandler.processor = processor
+        server = HTTPServer(('localhost', 8080), MJPEGStreamHandler)
     server_thread = threading.Thread(target=server.serve_forever, daemon=True)
     server_thread.start()
     
@@ -485,8 +956,9 @@ def main():
         print("\n\nShutting down...")
     finally:
         processor.disable_autopilot()
+        processor.autopilot.close()
         server.shutdown()
 
 
 if __name__ == "__main__":
-    main()
+    main(use_vo="--vo" in sys.argv)